@@ -0,0 +1,108 @@
+#
+# Change detection between runs. Awards harvested now are compared with the
+# awards saved by an earlier run (--save-awards): each award is keyed by its
+# id and a hash of its content, and classified as new, amended or unchanged.
+# Only new and amended awards need matching again, reports list them on a
+# changes sheet, and can be limited to them.
+#
+import hashlib
+import json
+import logging
+
+
+NEW = 'new'
+AMENDED = 'amended'
+UNCHANGED = 'unchanged'
+
+ID_FIELDS = {
+    'nsf': 'id',
+    'nih': 'id',
+    'doe': 'Award Number',
+}
+
+
+def content_hash(award):
+    """
+    SHA-1 of the award's fields, independent of their order.
+    """
+
+    data = json.dumps(award, sort_keys=True, default=str)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+def changed_fields(old, new):
+    return sorted(k for k in set(old) | set(new) if old.get(k) != new.get(k))
+
+
+def diff_awards(source, awards, previous):
+    """
+    Compare awards with the previous run's awards of the same source. Returns
+    a list of (status, fields) in award order, where status is NEW, AMENDED or
+    UNCHANGED and fields lists the fields that changed for AMENDED awards
+    (e.g. 'Amount Awarded this FY' for DOE or 'estimatedTotalAmt' for NSF).
+    """
+
+    id_field = ID_FIELDS[source]
+    previous = {str(x[id_field]): x for x in previous}
+
+    changes = []
+    for award in awards:
+        old = previous.get(str(award[id_field]))
+        if old is None:
+            changes.append((NEW, []))
+        elif content_hash(old) == content_hash(award):
+            changes.append((UNCHANGED, []))
+        else:
+            fields = changed_fields(old, award)
+            logging.info(f'{source.upper()} award {award[id_field]} amended: {", ".join(fields)}')
+            changes.append((AMENDED, fields))
+
+    counts = {status: 0 for status in (NEW, AMENDED, UNCHANGED)}
+    for status, _ in changes:
+        counts[status] += 1
+    logging.warning(f'{source.upper()} awards since the previous run: {counts[NEW]} new, '
+                    f'{counts[AMENDED]} amended, {counts[UNCHANGED]} unchanged')
+    return changes
+
+
+def previous_matches(source, previous, userlist_version):
+    """
+    Return {award id: match} from a previous run's saved awards, if they were
+    matched against the same userlist. Otherwise returns an empty dict.
+    """
+
+    if 'matches' not in previous or previous.get('userlist') != userlist_version:
+        return {}
+    id_field = ID_FIELDS[source]
+    return {str(x[id_field]): match for x, match in zip(previous['awards'], previous['matches'])}
+
+
+def match_changed(match, source, awards, changes, reuse, name_dict, processes=None):
+    """
+    Match the awards that are new or amended, or unchanged but without a match
+    in reuse, by calling match(awards, name_dict, processes). Unchanged awards
+    take their match from reuse. Returns the matches in award order.
+    """
+
+    id_field = ID_FIELDS[source]
+    pending = [x for x, (award, (status, _)) in enumerate(zip(awards, changes))
+               if status != UNCHANGED or str(award[id_field]) not in reuse]
+    logging.info(f'matching {len(pending)} of {len(awards)} {source.upper()} awards')
+
+    matches = [reuse.get(str(award[id_field])) for award in awards]
+    for x, found in zip(pending, match([awards[x] for x in pending], name_dict, processes)):
+        matches[x] = found
+    return matches
+
+
+def write_changes(report, source, awards, changes):
+    """
+    Add a changes sheet to a ReportWriter listing the new and amended awards,
+    with the fields that changed.
+    """
+
+    id_field = ID_FIELDS[source]
+    report.add_sheet('changes', [id_field, 'change', 'changed fields'])
+    for award, (status, fields) in zip(awards, changes):
+        if status != UNCHANGED:
+            report.append('changes', [award[id_field], status, ', '.join(fields)])
@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+#
+# Single entry point for the funding scrapers:
+#
+#   cli.py nsf|nih|doe ...   harvest, match and report one source
+#   cli.py all ...           the same for all three sources
+#   cli.py match ...         match previously saved awards against a userlist
+#   cli.py report ...        write the output workbook from saved matches
+#
+# Nothing heavy is imported here. Each source module is imported only when its
+# subcommand runs, and the modules themselves import requests, bs4, openpyxl,
+# xlsxwriter and fuzzywuzzy inside the stage that needs them.
+#
+import argparse
+import importlib
+import json
+import logging
+import os
+
+
+logging.basicConfig(level=logging.WARNING)
+
+SOURCES = {
+    'nsf': 'nsf_api_scraper',
+    'nih': 'nih_api_scraper',
+    'doe': 'doe_scraper',
+}
+
+
+def data_path(args, name):
+    """
+    Resolve a file name given on the command line against --data-dir.
+    """
+
+    if name is None:
+        return None
+    return os.path.join(args.data_dir, name)
+
+
+def add_common_arguments(parser):
+    parser.add_argument('-d', '--data-dir', dest='data_dir', default='/data', help='folder for input and output files, default = /data')
+    parser.add_argument('-p', '--processes', dest='processes', type=int, help='number of processes used for matching, default = number of cores')
+    parser.add_argument('-t', '--table', dest='table', action='store_true', help='write each output sheet as an Excel table')
+    parser.add_argument('--score-cache', dest='score_cache', help='file to keep fuzzy match scores in between runs')
+
+
+def add_search_arguments(parser, source):
+    parser.add_argument('-s', '--start', dest='start_date', help='range start date, format = YYYYMMDD', required=True)
+    parser.add_argument('-e', '--end', dest='end_date', help='range end date, format = YYYYMMDD', required=True)
+    if source in ('nsf', 'doe', 'all'):
+        parser.add_argument('-i', '--institution', '--inst', dest='inst', nargs='+', help='one or more institution search terms, default = University of Texas')
+        parser.add_argument('--institution-file', dest='inst_file', help='file of institution search terms, one per line')
+    else:
+        # Kept so the NIH command line matches the others; NIH searches by
+        # the exact names in the institution map instead.
+        parser.add_argument('-i', '--institution', '--inst', dest='inst', nargs='+', help=argparse.SUPPRESS)
+    parser.add_argument('-m', '--institution-map', dest='inst_map', help='JSON file mapping API institution names to our own')
+    parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=4, help='number of concurrent requests, default = 4')
+    fixtures = parser.add_mutually_exclusive_group()
+    fixtures.add_argument('--record', dest='record', metavar='DIR', help='save every API response to this folder')
+    fixtures.add_argument('--replay', dest='replay', metavar='DIR', help='answer API requests from responses saved with --record, without network access')
+    if source in ('doe', 'all'):
+        parser.add_argument('--partitions', dest='partitions', type=int, default=1, help='split the DOE date range into this many searches run in parallel, default = 1')
+    if source in ('nsf', 'nih', 'all'):
+        parser.add_argument('--by-pi', dest='by_pi', action='store_true', help='search for the PIs in the userlist instead of whole institutions (NSF and NIH only)')
+    parser.add_argument('-u', '--userlist', dest='userlist', help='input file with list of names and affiliations')
+    parser.add_argument('-o', '--output', dest='output', help='output file, written as <SOURCE>_<output>')
+    parser.add_argument('--save-awards', dest='save_awards', help='also save the harvested awards and their matches to this JSON file (<SOURCE>_ prefix added)')
+    parser.add_argument('--previous', dest='previous', help='awards JSON file saved with --save-awards by an earlier run (<SOURCE>_ prefix added); only new and amended awards are matched again')
+    parser.add_argument('--delta-only', dest='delta_only', action='store_true', help='only write new and amended awards to the output (requires --previous)')
+    add_common_arguments(parser)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Scrape NSF, NIH and DOE funded awards and match them to a userlist')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    for source, name in (('nsf', 'NSF'), ('nih', 'NIH'), ('doe', 'DOE'), ('all', 'NSF, NIH and DOE')):
+        add_search_arguments(subparsers.add_parser(source, help=f'scrape {name} funded awards'), source)
+
+    match_parser = subparsers.add_parser('match', help='match saved awards against a userlist')
+    match_parser.add_argument('-a', '--awards', dest='awards', help='awards JSON file saved with --save-awards', required=True)
+    match_parser.add_argument('-u', '--userlist', dest='userlist', help='input file with list of names and affiliations', required=True)
+    match_parser.add_argument('-o', '--output', dest='output', help='matches JSON file', required=True)
+    add_common_arguments(match_parser)
+
+    report_parser = subparsers.add_parser('report', help='write the output workbook from saved matches')
+    report_parser.add_argument('-M', '--matches', dest='matches', help='matches JSON file written by match', required=True)
+    report_parser.add_argument('-o', '--output', dest='output', help='output file', required=True)
+    add_common_arguments(report_parser)
+
+    return parser
+
+
+def save_json(path, source, awards, matches=None, userlist=None, changes=None):
+    data = {'source': source, 'awards': awards}
+    if matches is not None:
+        data['matches'] = matches
+    if userlist is not None:
+        data['userlist'] = userlist
+    if changes is not None:
+        data['changes'] = changes
+    with open(path, 'w') as f:
+        json.dump(data, f)
+
+
+def load_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def load_userlist(args):
+    """
+    Load the userlist, and the saved match scores for it if --score-cache
+    was given.
+    """
+
+    from matching import load_userlist
+    from score_cache import SCORES, userlist_version
+
+    userlist = data_path(args, args.userlist)
+    if args.score_cache:
+        SCORES.load(data_path(args, args.score_cache), userlist_version(userlist))
+    return load_userlist(userlist)
+
+
+def save_scores(args):
+    from score_cache import SCORES
+
+    if args.score_cache:
+        logging.warning(SCORES.stats())
+        SCORES.save(data_path(args, args.score_cache))
+    else:
+        logging.info(SCORES.stats())
+
+
+def run_source(source, args, name_dict=None):
+    """
+    Harvest one source, then match and write its report if a userlist and
+    output were given. With --previous, each award is classified against that
+    run (saved with the awards and listed on the report's changes sheet),
+    unchanged awards keep their saved matches and --delta-only leaves them out
+    of the report.
+    Returns the harvested awards.
+    """
+
+    module = importlib.import_module(SOURCES[source])
+    previous = None
+    if args.previous:
+        # Read before anything is saved: --save-awards may name the same file
+        path = data_path(args, f'{source.upper()}_{args.previous}')
+        try:
+            previous = load_json(path)
+        except FileNotFoundError:
+            logging.warning(f'{path} not found, treating every {source.upper()} award as new')
+            previous = {'source': source, 'awards': []}
+
+    awards = module.harvest(args, name_dict)
+    logging.info(f'{len(awards)} {source.upper()} awards harvested')
+
+    changes = None
+    if previous is not None:
+        import award_diff
+        changes = award_diff.diff_awards(source, awards, previous['awards'])
+
+    if args.save_awards:
+        save_json(data_path(args, f'{source.upper()}_{args.save_awards}'), source, awards, changes=changes)
+    if not (args.userlist and args.output):
+        return awards
+
+    from score_cache import userlist_version
+    version = userlist_version(data_path(args, args.userlist))
+
+    if previous is not None:
+        reuse = award_diff.previous_matches(source, previous, version)
+        matches = award_diff.match_changed(module.match, source, awards, changes, reuse,
+                                           name_dict, args.processes)
+    else:
+        matches = module.match(awards, name_dict, args.processes)
+
+    if args.save_awards:
+        save_json(data_path(args, f'{source.upper()}_{args.save_awards}'), source, awards, matches, version, changes)
+
+    report_awards, report_matches, report_changes = awards, matches, changes
+    if args.delta_only:
+        delta = [x for x, (status, _) in enumerate(changes) if status != award_diff.UNCHANGED]
+        report_awards = [awards[x] for x in delta]
+        report_matches = [matches[x] for x in delta]
+        report_changes = [changes[x] for x in delta]
+    module.write_report(report_awards, report_matches, data_path(args, f'{source.upper()}_{args.output}'),
+                        args.table, report_changes)
+    return awards
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    if args.command in ('match', 'report'):
+        data = load_json(data_path(args, args.awards if args.command == 'match' else args.matches))
+        module = importlib.import_module(SOURCES[data['source']])
+        if args.command == 'match':
+            name_dict = load_userlist(args)
+            matches = module.match(data['awards'], name_dict, args.processes)
+            save_scores(args)
+            from score_cache import userlist_version
+            save_json(data_path(args, args.output), data['source'], data['awards'], matches,
+                      userlist_version(data_path(args, args.userlist)), data.get('changes'))
+        else:
+            module.write_report(data['awards'], data['matches'], data_path(args, args.output), args.table,
+                                data.get('changes'))
+        return
+
+    if not (args.userlist and args.output) and not args.save_awards:
+        parser.error('either --userlist and --output, or --save-awards, is required')
+    args.by_pi = getattr(args, 'by_pi', False)
+    if args.by_pi and not args.userlist:
+        parser.error('--by-pi requires --userlist')
+    if args.delta_only and not args.previous:
+        parser.error('--delta-only requires --previous')
+
+    if args.record or args.replay:
+        import fixtures
+        fixtures.configure(data_path(args, args.record), data_path(args, args.replay))
+
+    args.inst_map = data_path(args, args.inst_map)
+    if getattr(args, 'inst_file', None):
+        args.inst_file = data_path(args, args.inst_file)
+
+    name_dict = None
+    if args.userlist:
+        name_dict = load_userlist(args)
+
+    if args.command == 'all':
+        for source in SOURCES:
+            run_source(source, args, name_dict)
+    else:
+        run_source(args.command, args, name_dict)
+
+    if args.userlist and args.output:
+        save_scores(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,16 +1,18 @@
-import requests
-from bs4 import BeautifulSoup
-import argparse
 import datetime
 import re
 import logging
-from openpyxl import load_workbook
-import xlsxwriter
-from fuzzy_match import fuzzy_match
+from fuzzy_match import match_name, write_match
+from report_writer import ReportWriter
+from award_diff import write_changes
+from institution_filter import build_filter, load_institution_terms
+from matching import match_awards
+from concurrent.futures import ThreadPoolExecutor
 import sys
 
 logging.basicConfig(level=logging.WARNING)
 
+URL = 'https://pamspublic.science.energy.gov/WebPAMSExternal/Interface/Awards/AwardSearchExternal.aspx'
+
 AWARD_INFO = ['Award Number',
               'Title',
               'Institution',
@@ -33,113 +35,180 @@ AWARD_INFO = ['Award Number',
               ]
 
 
-def main():
-    url = 'https://pamspublic.science.energy.gov/WebPAMSExternal/Interface/Awards/AwardSearchExternal.aspx'
+def harvest(args, name_dict=None):
+    """
+    Search all DOE awards for the command line arguments (see cli). Returns a
+    list of dictionaries, each containing the data of a single award entry.
+    """
 
-    parser = argparse.ArgumentParser(description='Scrape DOE-funded awards')
-    parser.add_argument('-s', '--start', dest='start_date', help='range start date, format = YYYYMMDD', required=True)
-    parser.add_argument('-e', '--end', dest='end_date', help='range start date, format = YYYYMMDD', required=True)
-    parser.add_argument('-u', '--userlist', dest='userlist', help='list of names and affiliations', required=True)
-    parser.add_argument('-o', '--output', dest='output', help='output file', required=True)
-    args = parser.parse_args()
+    if getattr(args, 'by_pi', False):
+        logging.warning('DOE does not support --by-pi, searching by institution instead')
 
-    start = datetime.datetime.strptime(args.start_date, '%Y%m%d').strftime('%-m/%-d/%Y')
-    start_validation = datetime.datetime.strptime(args.start_date, '%Y%m%d').strftime('%Y-%m-%d-00-00-00')
-    end = datetime.datetime.strptime(args.end_date, '%Y%m%d').strftime('%-m/%-d/%Y')
-    end_validation = datetime.datetime.strptime(args.end_date, '%Y%m%d').strftime('%Y-%m-%d-23-59-59')
+    institutions = load_institution_terms(args.inst, args.inst_file) or ['University of Texas']
+    institutions = [x.replace('+', ' ') for x in institutions]
 
-    final_results = []  # A list of dictionaries, each containing the data of a single award entry
+    start = datetime.datetime.strptime(args.start_date, '%Y%m%d').date()
+    end = datetime.datetime.strptime(args.end_date, '%Y%m%d').date()
+    date_ranges = split_date_range(start, end, getattr(args, 'partitions', 1))
 
-    make_requests(url, start, start_validation, end, end_validation, final_results)
-    write_output_sheet(final_results, './data/' + args.userlist, './data/' + f'DOE_{args.output}')
+    final_results = search_institutions(URL, date_ranges, institutions, args.jobs)
+    if args.inst_map:
+        inst_filter = build_filter(args.inst_map)
+        final_results = list(inst_filter.filter(final_results, 'Institution'))
+    return final_results
 
 
-def make_requests(url, start, start_validation, end, end_validation, final_results):
+def split_date_range(start, end, partitions=1):
     """
-    Retrieve specific award information by making several POST requests. The information returned
-    is in the FINAL_RESULTS list.
+    Split the days from start to end (dates, both included) into up to
+    PARTITIONS contiguous sub-ranges of about the same length. Returns a list
+    of (start, start_validation, end, end_validation) tuples in the formats the
+    search form expects.
     """
-    with requests.Session() as session:
-        # Start a session with a post request to the url
-        try:
-            res = session.post(url, timeout=20)
-        except requests.exceptions.ReadTimeout:
-            logging.error('timeout during search...try again later')
-            sys.exit()
-        except Exception as x:
-            logging.error(f'request failed because {x}')
-            sys.exit()
 
-        # Use response to grab fields necessary for a valid search to go through
-        soup = BeautifulSoup(res.content, 'html.parser')
-
-        # Update payload with fields, incl. search params
-        payload = {
-            "ctl00_REIRadScriptManager1_TSM": soup.find(attrs={"name": "ctl00_REIRadScriptManager1_TSM"})['value'],
-            "__EVENTTARGET": "ctl00$MainContent$grdAwardsList",
-            "__EVENTARGUMENT": "FireCommand:ctl00$MainContent$grdAwardsList$ctl36;PageSize;100",
-            "__VIEWSTATE": soup.find(attrs={"name": "__VIEWSTATE"})['value'],
-            "__VIEWSTATEGENERATOR": soup.find(attrs={"name": "__VIEWSTATEGENERATOR"})['value'],
-            # Institution name like:
-            "ctl00$MainContent$pnlSearch$txtInstitutionName": "University of Texas",
-            # Award start date:
-            "ctl00$MainContent$pnlSearch$dpPPSDFrom$dateInput": f"{start}",
-            "ctl00_MainContent_pnlSearch_dpPPSDFrom_dateInput_ClientState":
-                f"{{'enabled':true,'emptyMessage':'','validationText':'{start_validation}', \
-                    'valueAsString':'{start_validation}','minDateStr':'1980-00-01-00-01-00', \
-                    'maxDateStr':'2099-00-31-00-12-00','lastSetTextBoxValue':'{start}'}}",
-            "ctl00$MainContent$pnlSearch$dpPPSDTo$dateInput": f"{end}",
-            "ctl00_MainContent_pnlSearch_dpPPSDTo_dateInput_ClientState":
-                f"{{'enabled':true,'emptyMessage':'','validationText':'{end_validation}', \
-                    'valueAsString':'{end_validation}','minDateStr':'1980-00-01-00-01-00', \
-                    'maxDateStr':'2099-00-31-00-12-00','lastSetTextBoxValue':'{end}'}}",
-        }
-
-        # Make another request to update results per page with __EVENTARGUMENT param
-        try:
-            res = session.post(url, data=payload)
-        except Exception as x:
-            logging.error(f'request failed because {x}')
-            sys.exit()
+    days = (end - start).days + 1
+    partitions = max(1, min(partitions or 1, days))
+    date_ranges = []
+    for x in range(partitions):
+        sub_start = start + datetime.timedelta(days=days * x // partitions)
+        sub_end = start + datetime.timedelta(days=days * (x + 1) // partitions - 1)
+        date_ranges.append((sub_start.strftime('%-m/%-d/%Y'),
+                            sub_start.strftime('%Y-%m-%d-00-00-00'),
+                            sub_end.strftime('%-m/%-d/%Y'),
+                            sub_end.strftime('%Y-%m-%d-23-59-59')))
+    return date_ranges
 
-        # Grab updated viewstate that includes larger results per page included
-        # Update payload
-        soup = BeautifulSoup(res.content, 'html.parser')
-        payload['__VIEWSTATE'] = soup.find(attrs={"name": "__VIEWSTATE"})['value']
 
-        # Finally, make first search
+def search_institutions(url, date_ranges, institutions, jobs=4):
+    """
+    Run make_requests for each institution term and date sub-range
+    concurrently. Every search gets its own session (the search form keeps its
+    viewstate in the session) but all of them share one connection pool.
+    Returns the merged list of award entries with duplicate Award Numbers
+    removed.
+    """
+
+    from http_client import make_adapter, make_session
+
+    adapter = make_adapter(pool_size=max(jobs, 1))
+    searches = [(institution, date_range) for institution in institutions for date_range in date_ranges]
+
+    def search(args):
+        institution, (start, start_validation, end, end_validation) = args
+        results = []
+        make_requests(url, start, start_validation, end, end_validation, results,
+                      institution, make_session(adapter))
+        return results
+
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        result_lists = list(executor.map(search, searches))
+
+    final_results = {}
+    for results in result_lists:
+        for entry in results:
+            final_results.setdefault(entry['Award Number'], entry)
+    logging.info(f'{len(final_results)} unique awards found in {len(searches)} searches')
+    return list(final_results.values())
+
+
+def make_requests(url, start, start_validation, end, end_validation, final_results,
+                  institution='University of Texas', session=None):
+    """
+    Retrieve specific award information by making several POST requests. The information returned
+    is in the FINAL_RESULTS list.
+    """
+    import requests
+    from bs4 import BeautifulSoup
+    from http_client import make_session
+
+    if session is None:
+        session = make_session()
+    # Start a session with a post request to the url
+    try:
+        res = session.post(url, timeout=20)
+    except requests.exceptions.ReadTimeout:
+        logging.error('timeout during search...try again later')
+        sys.exit()
+    except Exception as x:
+        logging.error(f'request failed because {x}')
+        sys.exit()
+
+    # Use response to grab fields necessary for a valid search to go through
+    soup = BeautifulSoup(res.content, 'html.parser')
+
+    # Update payload with fields, incl. search params
+    payload = {
+        "ctl00_REIRadScriptManager1_TSM": soup.find(attrs={"name": "ctl00_REIRadScriptManager1_TSM"})['value'],
+        "__EVENTTARGET": "ctl00$MainContent$grdAwardsList",
+        "__EVENTARGUMENT": "FireCommand:ctl00$MainContent$grdAwardsList$ctl36;PageSize;100",
+        "__VIEWSTATE": soup.find(attrs={"name": "__VIEWSTATE"})['value'],
+        "__VIEWSTATEGENERATOR": soup.find(attrs={"name": "__VIEWSTATEGENERATOR"})['value'],
+        # Institution name like:
+        "ctl00$MainContent$pnlSearch$txtInstitutionName": institution,
+        # Award start date:
+        "ctl00$MainContent$pnlSearch$dpPPSDFrom$dateInput": f"{start}",
+        "ctl00_MainContent_pnlSearch_dpPPSDFrom_dateInput_ClientState":
+            f"{{'enabled':true,'emptyMessage':'','validationText':'{start_validation}', \
+                'valueAsString':'{start_validation}','minDateStr':'1980-00-01-00-01-00', \
+                'maxDateStr':'2099-00-31-00-12-00','lastSetTextBoxValue':'{start}'}}",
+        "ctl00$MainContent$pnlSearch$dpPPSDTo$dateInput": f"{end}",
+        "ctl00_MainContent_pnlSearch_dpPPSDTo_dateInput_ClientState":
+            f"{{'enabled':true,'emptyMessage':'','validationText':'{end_validation}', \
+                'valueAsString':'{end_validation}','minDateStr':'1980-00-01-00-01-00', \
+                'maxDateStr':'2099-00-31-00-12-00','lastSetTextBoxValue':'{end}'}}",
+    }
+
+    # Make another request to update results per page with __EVENTARGUMENT param
+    try:
+        res = session.post(url, data=payload)
+    except Exception as x:
+        logging.error(f'request failed because {x}')
+        sys.exit()
+
+    # Grab updated viewstate that includes larger results per page included
+    # Update payload
+    soup = BeautifulSoup(res.content, 'html.parser')
+    payload['__VIEWSTATE'] = soup.find(attrs={"name": "__VIEWSTATE"})['value']
+
+    # Finally, make first search
+    try:
+        res = session.post(url, data=payload)
+    except Exception as x:
+        logging.error(f'request failed because {x}')
+        sys.exit()
+    parse_html(res.content, final_results)
+
+    # get all event target values
+    event_target = soup.find_all("div", {"class": "rgNumPart"})
+    if not event_target:
+        # No pager, so nothing beyond the first page of results
+        return
+    event_target = event_target[0]
+    event_target_list = [
+        re.search('__doPostBack\(\'(.*)\',', t["href"]).group(1)
+        for t in event_target.find_all('a')
+    ]
+
+    # Make updated post request to perform actual search
+    for link in event_target_list[1:]:
+        payload['__EVENTTARGET'] = link
+        payload['__VIEWSTATE'] = soup.find(attrs={"name": "__VIEWSTATE"})['value']
         try:
             res = session.post(url, data=payload)
         except Exception as x:
             logging.error(f'request failed because {x}')
             sys.exit()
+        soup = BeautifulSoup(res.content, "html.parser")
         parse_html(res.content, final_results)
 
-        # get all event target values
-        event_target = soup.find_all("div", {"class": "rgNumPart"})[0]
-        event_target_list = [
-            re.search('__doPostBack\(\'(.*)\',', t["href"]).group(1)
-            for t in event_target.find_all('a')
-        ]
-
-        # Make updated post request to perform actual search
-        for link in event_target_list[1:]:
-            payload['__EVENTTARGET'] = link
-            payload['__VIEWSTATE'] = soup.find(attrs={"name": "__VIEWSTATE"})['value']
-            try:
-                res = session.post(url, data=payload)
-            except Exception as x:
-                logging.error(f'request failed because {x}')
-                sys.exit()
-            soup = BeautifulSoup(res.content, "html.parser")
-            parse_html(res.content, final_results)
-
 
 def parse_html(response_content, final_results):
     """
     Given a POST response HTML page, grab all search results (award listings)
     on the page and append their results to the final_results list.
     """
+    from bs4 import BeautifulSoup
+
     # Grab fields that contain the data
     soup = BeautifulSoup(response_content, 'html.parser')
     table = soup.find(class_="rgMasterTable")
@@ -188,43 +257,29 @@ def parse_html(response_content, final_results):
     final_results += results_list
 
 
-def write_output_sheet(award_dict, userlist, output):
+def match_award(item, name_dict):
     """
-    Given a dictionary of award information and a list of TACC usernames, write
-    an output workbook with two worksheets: (1) Awards that match a TACC username
-    and (2) awards that don't match a TACC username.
+    Match one award's PI against the TACC userlist (see fuzzy_match.match_name).
     """
 
-    userlist_wb = load_workbook(filename=userlist, read_only=True)
-    worksheet = userlist_wb['utrc_institution_accounts']
-    row_count = worksheet.max_row
-    rows = worksheet.rows
+    return match_name(logging, item['PI First Name'], item['PI Last Name'], name_dict)
 
-    name_dict = {}
 
-    if row_count > 1:
-        next(rows)  # skip header row
-        for row in rows:
-            institution = row[0].value
-            first_name = row[1].value
-            last_name = row[2].value
-            utrc_full_name = ' '.join([first_name, last_name]).lower().replace(' ', '')
-            name_dict[utrc_full_name] = [institution, first_name, last_name]
+def write_output_sheet(award_dict, matches, output, table=False, changes=None):
+    """
+    Given a list of award information and the match for each award, write
+    an output workbook with two worksheets: (1) Awards that match a TACC username
+    and (2) awards that don't match a TACC username.
+    """
 
-    logging.info(f'number of items in name_dict = {len(name_dict.keys())}')
     logging.info(f'number of awards found = {len(award_dict)}')
 
-    workbook = xlsxwriter.Workbook(output)
-    bold = workbook.add_format({'bold': 1})
-    found_worksheet = workbook.add_worksheet('utrc_doe_funding')
-    found_worksheet.write_row(0, 0, ['utrc_institution', 'utrc_first_name', 'utrc_last_name']+AWARD_INFO, bold)
-    not_found_worksheet = workbook.add_worksheet('not_utrc_doe_funding')
-    not_found_worksheet.write_row(0, 0, AWARD_INFO, bold)
+    report = ReportWriter(output, table)
+    report.add_sheet('utrc_doe_funding', ['utrc_institution', 'utrc_first_name', 'utrc_last_name']+AWARD_INFO)
+    report.add_sheet('not_utrc_doe_funding', AWARD_INFO)
 
-    f_row = 1
-    nf_row = 1
     # For each award found through this search
-    for item in award_dict:
+    for item, match in zip(award_dict, matches):
         base_info = [item['Award Number'],
                      item['Title'],
                      item['Institution'],
@@ -244,31 +299,28 @@ def write_output_sheet(award_dict, userlist, output):
                      item['Program Area'],
                      item['Register Number'],
                      item['DUNS']]
-        award_full_name = ' '.join([item['PI First Name'], item['PI Last Name']]).lower().replace(' ', '')
-
-        # Add it to found if exact match
-        if award_full_name in name_dict.keys():
-            logging.info(f"{award_full_name} matches {name_dict[award_full_name]}")
-            found_worksheet.write_row(f_row, 0,
-                                      [name_dict[award_full_name][0],
-                                       name_dict[award_full_name][1],
-                                       name_dict[award_full_name][2]
-                                       ]+base_info)
-            f_row += 1
-        # Otherwise, do a fuzzy pattern matching check
-        else:
-            fuzzycheck = fuzzy_match(logging, item['PI Last Name'], name_dict, found_worksheet,
-                                     not_found_worksheet, award_full_name,
-                                     base_info, workbook, f_row, nf_row)
-
-            if fuzzycheck is False:
-                nf_row += 1
-            else:
-                f_row += 1
-
-    workbook.close()
+
+        # Exact matches and fuzzy matches go to found, the rest to not found
+        write_match(report, 'utrc_doe_funding', 'not_utrc_doe_funding', match, base_info)
+
+    if changes is not None:
+        write_changes(report, 'doe', award_dict, changes)
+    report.close()
     return
 
+
+def match(awards, name_dict, processes=None):
+    return match_awards(match_award, awards, name_dict, processes)
+
+
+def write_report(awards, matches, output, table=False, changes=None):
+    write_output_sheet(awards, matches, output, table, changes)
+
+
+def main():
+    import cli
+    cli.main(['doe'] + sys.argv[1:])
+
+
 if __name__ == '__main__':
     main()
-    
@@ -0,0 +1,117 @@
+#
+# Recorded HTTP responses for offline runs. With record set, every response a
+# ThrottledSession gets is also saved to the fixture folder; with replay set,
+# requests are answered from that folder and never reach the network (or the
+# rate limiter). A fixture is one gzipped JSON file per request, named by a
+# hash of the method, the full URL and the request body, so a replayed run
+# sends the same requests and gets the same responses as the recorded one.
+#
+import base64
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+
+
+_record = None
+_replay = None
+
+
+class MissingFixtureError(Exception):
+    """
+    Raised in replay mode for a request that was not recorded.
+    """
+
+
+def configure(record=None, replay=None):
+    """
+    Set the folder responses are recorded to, or replayed from. Both None
+    (the default) turns fixtures off.
+    """
+
+    global _record, _replay
+    if record:
+        os.makedirs(record, exist_ok=True)
+    _record, _replay = record, replay
+
+
+def recording():
+    return _record is not None
+
+
+def replaying():
+    return _replay is not None
+
+
+def _prepare(method, url, kwargs):
+    import requests
+
+    return requests.Request(method, url, params=kwargs.get('params'), data=kwargs.get('data'),
+                            json=kwargs.get('json')).prepare()
+
+
+def fixture_key(method, url, kwargs):
+    """
+    Hash of the method, URL with query parameters, and body of a request.
+    """
+
+    prepared = _prepare(method, url, kwargs)
+    body = prepared.body or b''
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    digest = hashlib.sha1(f'{prepared.method} {prepared.url}\n'.encode('utf-8'))
+    digest.update(body)
+    return digest.hexdigest()
+
+
+def _path(directory, key):
+    return os.path.join(directory, f'{key}.json.gz')
+
+
+def record(method, url, kwargs, response):
+    key = fixture_key(method, url, kwargs)
+    data = {
+        'method': method,
+        'url': response.url,
+        'status': response.status_code,
+        'reason': response.reason,
+        'headers': dict(response.headers),
+        'encoding': response.encoding,
+        'content': base64.b64encode(response.content).decode('ascii'),
+    }
+    path = _path(_record, key)
+    # Write and rename, so concurrent requests never leave a partial file
+    temp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with gzip.open(temp, 'wt', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(temp, path)
+    logging.debug(f'recorded {method} {url} as {key}')
+
+
+def replay(method, url, kwargs):
+    """
+    Return the recorded requests.Response for a request, or raise
+    MissingFixtureError.
+    """
+
+    from requests.models import Response
+    from requests.structures import CaseInsensitiveDict
+
+    key = fixture_key(method, url, kwargs)
+    try:
+        with gzip.open(_path(_replay, key), 'rt', encoding='utf-8') as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        raise MissingFixtureError(f'no recorded response for {method} {url} in {_replay}')
+
+    response = Response()
+    response.status_code = data['status']
+    response.reason = data['reason']
+    response.headers = CaseInsensitiveDict(data['headers'])
+    response.encoding = data['encoding']
+    response.url = data['url']
+    response.request = _prepare(method, url, kwargs)
+    response._content = base64.b64decode(data['content'])
+    return response
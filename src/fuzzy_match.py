@@ -1,37 +1,58 @@
-from fuzzywuzzy import fuzz
+from normalize import full_key
+from score_cache import ratio
 
-def fuzzy_match(logging, last_name, name_dict, found_worksheet,
-                not_found_worksheet, award_full_name,
-                base_info, workbook, f_row, nf_row):
+def fuzzy_match(logging, last_name, name_dict, award_full_name):
     """
     Given a search results award PI name, fuzzy match against each entry in
-    the TACC userlist database. Accept matches in two categories--80-88% and 89+%.
+    the TACC userlist database with the same last name. Accept matches in two
+    categories--80-88% and 89+%. Returns (userlist entry, match percent) for the
+    first accepted match, or None.
     """
-    f_format = workbook.add_format({'bg_color': '#90EE90'})
-    nf_format = workbook.add_format({'bg_color': '#FCC981'})
-    for key, values in name_dict.items():
-        # Last name MUST match exactly
-        if last_name.capitalize() == values[2].capitalize():
-            match_percent = fuzz.ratio(award_full_name, key)
-            # If first name 89+% match, add it to found and highlight green
-            if match_percent >= 89:
-                logging.info(f"{award_full_name} fuzzy matches {values[1:2]} \
-                               --match percent = {match_percent}")
-                found_worksheet.write_row(f_row, 0, [values[0], values[1], values[2]]
-                                          + base_info
-                                          + [f"match percent = {match_percent}"], f_format)
-                return True
-            # If first name 80+% match, add it to found and highlight orange
-            elif match_percent >= 80:
-                logging.info(f"{award_full_name} fuzzy matches {values[1:2]} \
-                               --match percent = {match_percent}")
-                # Log and color the field in orange
-                found_worksheet.write_row(f_row, 0, [values[0], values[1], values[2]]
-                                          + base_info
-                                          + [f"match percent = {match_percent}"], nf_format)
-                return True
-    # If no matches >=80%, add to not found workbook
+    # Last name MUST match exactly
+    for key, _, values in name_dict.candidates(last_name):
+        match_percent = ratio(award_full_name, key)
+        # If first name 80+% match, it is a match
+        if match_percent >= 80:
+            logging.info(f"{award_full_name} fuzzy matches {values[1:2]} \
+                           --match percent = {match_percent}")
+            return values, match_percent
+    # If no matches >=80%, it goes to the not found workbook
     logging.info(f"{award_full_name} has no match")
-    not_found_worksheet.write_row(nf_row, 0, base_info)
-    return False
+    return None
 
+
+def match_name(logging, first_name, last_name, name_dict):
+    """
+    Match an award PI against the TACC userlist (a NameIndex). Returns
+    (userlist entry, None) for a match on one of the normalized name keys,
+    (userlist entry, match percent) for a fuzzy match, or None if there is
+    no match.
+    """
+    values = name_dict.lookup(first_name, last_name)
+    award_full_name = full_key(first_name, last_name)
+    if values is not None:
+        logging.info(f'{award_full_name} matches {values}')
+        return values, None
+    return fuzzy_match(logging, last_name, name_dict, award_full_name)
+
+
+def write_match(report, found, not_found, match, base_info):
+    """
+    Write one award to the found or not found sheet of a ReportWriter, depending
+    on its match. Fuzzy matches are highlighted green (89+%) or orange (80-88%).
+    Returns True if the award went to the found sheet.
+    """
+    if match is None:
+        report.append(not_found, base_info)
+        return False
+
+    values, match_percent = match
+    if match_percent is None:
+        report.append(found, [values[0], values[1], values[2]] + base_info)
+        return True
+
+    report.append(found, [values[0], values[1], values[2]]
+                  + base_info
+                  + [f"match percent = {match_percent}"],
+                  'found' if match_percent >= 89 else 'maybe')
+    return True
@@ -0,0 +1,114 @@
+#
+# Shared HTTP sessions for the scrapers. One adapter (and so one connection
+# pool) can be mounted on several sessions, which keeps cookies separate per
+# session while reusing connections across concurrent searches. Every request
+# goes through the per-host limiter in rate_limit and is retried with backoff
+# on connection errors, 429 and 5xx responses. Responses can also be recorded
+# to, or replayed from, a folder of fixtures (see fixtures).
+#
+import logging
+import random
+import time
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from rate_limit import CircuitOpenError, get_limiter
+import fixtures
+
+
+POOL_SIZE = 10
+MAX_ATTEMPTS = 5
+BACKOFF = 1.0       # seconds, doubled on every retry
+MAX_BACKOFF = 60.0
+TIMEOUT = 20        # seconds, for requests that don't set their own
+
+
+def make_adapter(pool_size=POOL_SIZE):
+    """
+    Return an HTTPAdapter with a connection pool big enough for pool_size
+    concurrent requests per host. Retries are handled by ThrottledSession.
+    """
+
+    return HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+
+
+def _retry_after(response):
+    try:
+        return float(response.headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+class ThrottledSession(requests.Session):
+    """
+    A requests Session that waits for the host's rate limiter and concurrency
+    limit before each request, feeds the response status and latency back to
+    it, and retries failed requests up to MAX_ATTEMPTS times. Requests without
+    a timeout get TIMEOUT, so a stalled connection counts as a failure. In
+    replay mode responses come from the fixtures instead, without any
+    throttling.
+    """
+
+    def request(self, method, url, *args, **kwargs):
+        kwargs.setdefault('timeout', TIMEOUT)
+        if fixtures.replaying():
+            return fixtures.replay(method, url, kwargs)
+        response = self._throttled_request(method, url, *args, **kwargs)
+        if fixtures.recording():
+            fixtures.record(method, url, kwargs, response)
+        return response
+
+    def _throttled_request(self, method, url, *args, **kwargs):
+        limiter = get_limiter(urlsplit(url).netloc)
+        backoff = BACKOFF
+
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            try:
+                trial = limiter.breaker.wait()
+            except CircuitOpenError:
+                if attempt == MAX_ATTEMPTS:
+                    raise
+                logging.warning(f'{method} {url} waiting for {limiter.host}, retry {attempt} of {MAX_ATTEMPTS - 1}')
+                continue
+            limiter.bucket.acquire()
+            wait = None
+            try:
+                with limiter.concurrency:
+                    started = time.monotonic()
+                    try:
+                        response = super().request(method, url, *args, **kwargs)
+                    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as x:
+                        limiter.throttled()
+                        if attempt == MAX_ATTEMPTS:
+                            raise
+                        logging.warning(f'{method} {url} failed ({x}), retry {attempt} of {MAX_ATTEMPTS - 1}')
+                    else:
+                        if response.status_code != 429 and response.status_code < 500:
+                            limiter.success(time.monotonic() - started)
+                            return response
+                        limiter.throttled()
+                        if attempt == MAX_ATTEMPTS:
+                            return response
+                        logging.warning(f'{method} {url} returned {response.status_code}, retry {attempt} of {MAX_ATTEMPTS - 1}')
+                        wait = _retry_after(response)
+            finally:
+                # Any other exception must not leave the trial pending
+                if trial:
+                    limiter.breaker.release()
+
+            time.sleep(min(MAX_BACKOFF, wait if wait is not None else backoff * (1 + random.random())))
+            backoff *= 2
+
+
+def make_session(adapter=None):
+    """
+    Return a ThrottledSession using the given adapter for http and https, or
+    a new pooled adapter if none is given.
+    """
+
+    if adapter is None:
+        adapter = make_adapter()
+    session = ThrottledSession()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
@@ -0,0 +1,107 @@
+#
+# Institution filtering shared by the NSF, NIH and DOE scrapers. Exact
+# institution names are pushed into the API criteria where the API supports
+# it, and whatever comes back is checked against a prebuilt lookup table.
+#
+import json
+
+
+"""
+ALL_UNIVERSITIES maps the API institution names to our own. It is the
+default mapping used when no mapping file is given.
+"""
+
+ALL_UNIVERSITIES={
+    'UNIVERSITY OF TEXAS RIO GRANDE VALLEY': 'University of Texas Rio Grande Valley',
+    'UNIVERSITY OF TEXAS DALLAS': 'University of Texas at Dallas (UTD) (UT Dallas)',
+    'UNIVERSITY OF TEXAS HLTH CTR AT TYLER': 'University of Texas Health Science Center at Tyler',
+    'UNIVERSITY OF TX MD ANDERSON CAN CTR': 'University of Texas MD Anderson Cancer Center',
+    'UNIVERSITY OF TEXAS AT AUSTIN': 'University of Texas at Austin (UT) (UT Austin)',
+    'UNIVERSITY OF TEXAS HLTH SCI CTR HOUSTON': 'University of Texas Health Science Center at Houston',
+    'UT SOUTHWESTERN MEDICAL CENTER': 'University of Texas Southwestern Medical Center (UTSW) (UT Southwestern)',
+    'UNIVERSITY OF TEXAS TYLER': 'University of Texas Tyler',
+    'UNIVERSITY OF TEXAS HLTH SCIENCE CENTER': 'University of Texas Health Science Center at San Antonio',
+    'UNIVERSITY OF TEXAS ARLINGTON': 'University of Texas at Arlington (UTA) (UT Arlington)',
+    'UNIVERSITY OF TEXAS EL PASO': 'University of Texas at El Paso (UTEP)',
+    'UNIVERSITY OF TEXAS MED BR GALVESTON': 'University of Texas Medical Branch at Galveston',
+    'UNIVERSITY OF TEXAS OF THE PERMIAN BASIN': 'University of Texas Permian Basin',
+    'UNIVERSITY OF TEXAS SAN ANTONIO': 'University of Texas at San Antonio'
+}
+
+
+def _collapse(name):
+    return ' '.join(str(name).split()).upper()
+
+
+class InstitutionFilter:
+    """
+    Given a mapping of API institution names to our own, build a matcher that
+    accepts an institution name if it is exactly one of the mapped names (keys
+    or values, ignoring case and repeated whitespace).
+    """
+
+    def __init__(self, mapping):
+        self.mapping = dict(mapping)
+        self._names = set()
+        for api_name, our_name in self.mapping.items():
+            self._names.add(_collapse(api_name))
+            self._names.add(_collapse(our_name))
+
+    def org_names(self):
+        """
+        Exact institution names to send to the API criteria.
+        """
+        return list(self.mapping.keys())
+
+    def matches(self, name):
+        if not name:
+            return False
+        return _collapse(name) in self._names
+
+    def filter(self, rows, column):
+        """
+        Yield only the rows (dictionaries) whose column matches.
+        """
+        for row in rows:
+            if self.matches(row.get(column)):
+                yield row
+
+
+def load_institution_map(path):
+    """
+    Read a user supplied mapping file. The file is a JSON object of
+    {"API INSTITUTION NAME": "Our Institution Name", ...}.
+    """
+
+    with open(path) as f:
+        mapping = json.load(f)
+    if not isinstance(mapping, dict) or not mapping:
+        raise ValueError(f'{path} must contain a non-empty JSON object')
+    return mapping
+
+
+def load_institution_terms(terms=None, path=None):
+    """
+    Combine institution search terms given on the command line with those in a
+    terms file (one per line, blank lines and # comments ignored). Duplicates
+    are dropped, order is kept.
+    """
+
+    all_terms = list(terms or [])
+    if path:
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    all_terms.append(line)
+    return list(dict.fromkeys(all_terms))
+
+
+def build_filter(path=None):
+    """
+    Build an InstitutionFilter from a mapping file, or from ALL_UNIVERSITIES
+    if no file is given.
+    """
+
+    mapping = load_institution_map(path) if path else ALL_UNIVERSITIES
+    return InstitutionFilter(mapping)
@@ -0,0 +1,108 @@
+#
+# Match stage shared by the scrapers. The userlist is loaded once into a
+# name_dict, and awards are matched against it either in this process or
+# sharded across a process pool. Writing the output happens afterwards.
+#
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import logging
+import math
+import multiprocessing
+import os
+from normalize import NameIndex
+from score_cache import SCORES
+
+
+SHARD_MIN = 200
+
+# The userlist seen by pool workers. With the fork start method it is set in
+# the parent before the pool starts and inherited; otherwise it is sent once
+# per worker through the pool initializer.
+_name_dict = None
+
+
+def load_userlist(userlist):
+    """
+    Read the utrc_institution_accounts tab of the userlist workbook into a
+    NameIndex of normalized full name to [institution, first name, last name].
+    """
+
+    from openpyxl import load_workbook
+
+    userlist_wb = load_workbook(filename=userlist, read_only=True)
+    worksheet = userlist_wb['utrc_institution_accounts']
+    row_count = worksheet.max_row
+    rows = worksheet.rows
+
+    name_dict = NameIndex()
+
+    if row_count > 1:
+        next(rows) # skip header row
+        for row in rows:
+            institution = row[0].value
+            first_name = row[1].value
+            last_name = row[2].value
+            name_dict.add(institution, first_name, last_name)
+
+    logging.info(f'number of items in name_dict = {len(name_dict.keys())}')
+    return name_dict
+
+
+def _init_worker(name_dict=None, scores=None):
+    global _name_dict
+    if name_dict is not None:
+        _name_dict = name_dict
+    # Start counting from zero, whatever was inherited from the parent, and
+    # keep the new scores for _match_shard to send back
+    SCORES.take_new()
+    SCORES.track_new = True
+    if scores:
+        SCORES.merge(scores)
+
+
+def _match_shard(match_fn, shard):
+    """
+    Match one shard in a worker. Also returns the scores the worker computed
+    and its cache counters, for the parent's score cache.
+    """
+    results = [match_fn(item, _name_dict) for item in shard]
+    return results, SCORES.take_new()
+
+
+def match_awards(match_fn, awards, name_dict, processes=None):
+    """
+    Call match_fn(award, name_dict) for every award and return the results in
+    award order. match_fn must be a module level function so it can be sent to
+    the workers. With more than one process and enough awards, the award list
+    is split into contiguous shards that are matched in a process pool.
+    """
+
+    global _name_dict
+
+    awards = list(awards)
+    if processes is None:
+        processes = os.cpu_count() or 1
+    if processes <= 1 or len(awards) <= SHARD_MIN:
+        return [match_fn(item, name_dict) for item in awards]
+
+    shard_size = max(SHARD_MIN, math.ceil(len(awards) / (processes * 4)))
+    shards = [awards[i:i + shard_size] for i in range(0, len(awards), shard_size)]
+    logging.info(f'matching {len(awards)} awards in {len(shards)} shards on {processes} processes')
+
+    if 'fork' in multiprocessing.get_all_start_methods():
+        _name_dict = name_dict
+        pool = ProcessPoolExecutor(max_workers=processes, initializer=_init_worker,
+                                   mp_context=multiprocessing.get_context('fork'))
+    else:
+        pool = ProcessPoolExecutor(max_workers=processes, initializer=_init_worker,
+                                   initargs=(name_dict, SCORES.scores()))
+
+    try:
+        with pool:
+            results = []
+            for shard_results, (scores, hits, misses) in pool.map(partial(_match_shard, match_fn), shards):
+                results += shard_results
+                SCORES.merge(scores, hits, misses)
+    finally:
+        _name_dict = None
+    return results
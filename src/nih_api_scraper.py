@@ -4,15 +4,18 @@
 # https://api.reporter.nih.gov/
 #
 
-import argparse
 from datetime import datetime, timedelta
 import logging
 import json
-import requests
-from openpyxl import load_workbook
-import xlsxwriter
-from fuzzywuzzy import fuzz
+import sys
+from report_writer import ReportWriter
+from award_diff import write_changes
 import math
+from concurrent.futures import ThreadPoolExecutor
+from institution_filter import ALL_UNIVERSITIES, build_filter
+from matching import match_awards
+from normalize import first_key, full_key
+from score_cache import ratio
 
 logging.basicConfig(level=logging.WARNING)
 #format='%(asctime)s %(levelname)s %(message)s',
@@ -23,12 +26,15 @@ logging.basicConfig(level=logging.WARNING)
 Define the url for NIH API and the info being
 saved to our spreadsheets. AWARD_INFO is used to
 format our sheets that hold the desired data. 
-ALL_UNIVERSITIES maps the API institution names 
-to our own. 
+ALL_UNIVERSITIES (see institution_filter) maps the
+API institution names to our own. 
 """
 
 URL = 'https://api.reporter.nih.gov/v2/projects/search'
 
+# Number of PI names sent in one request with --by-pi
+PI_BATCH = 50
+
 AWARD_INFO=['id',
             'agency',
             'awardeeName',
@@ -43,36 +49,25 @@ AWARD_INFO=['id',
             'taccPDPI',
            ]
 
-ALL_UNIVERSITIES={
-    'UNIVERSITY OF TEXAS RIO GRANDE VALLEY': 'University of Texas Rio Grande Valley', 
-    'UNIVERSITY OF TEXAS DALLAS': 'University of Texas at Dallas (UTD) (UT Dallas)', 
-    'UNIVERSITY OF TEXAS HLTH CTR AT TYLER': 'University of Texas Health Science Center at Tyler', 
-    'UNIVERSITY OF TX MD ANDERSON CAN CTR': 'University of Texas MD Anderson Cancer Center', 
-    'UNIVERSITY OF TEXAS AT AUSTIN': 'University of Texas at Austin (UT) (UT Austin)', 
-    'UNIVERSITY OF TEXAS HLTH SCI CTR HOUSTON': 'University of Texas Health Science Center at Houston', 
-    'UT SOUTHWESTERN MEDICAL CENTER': 'University of Texas Southwestern Medical Center (UTSW) (UT Southwestern)', 
-    'UNIVERSITY OF TEXAS TYLER': 'University of Texas Tyler', 
-    'UNIVERSITY OF TEXAS HLTH SCIENCE CENTER': 'University of Texas Health Science Center at San Antonio', 
-    'UNIVERSITY OF TEXAS ARLINGTON': 'University of Texas at Arlington (UTA) (UT Arlington)', 
-    'UNIVERSITY OF TEXAS EL PASO': 'University of Texas at El Paso (UTEP)', 
-    'UNIVERSITY OF TEXAS MED BR GALVESTON': 'University of Texas Medical Branch at Galveston', 
-    'UNIVERSITY OF TEXAS OF THE PERMIAN BASIN': 'University of Texas Permian Basin', 
-    'UNIVERSITY OF TEXAS SAN ANTONIO': 'University of Texas at San Antonio'
-}
 
 def partition(l, n):
     for i in range(0, len(l), n):
         yield l[i:i + n]
 
-def splitDateRange(origin,N,blocks):
+def splitDateRange(origin,N,blocks,org_names=None):
 
     """
     Given an origin (start date), the number of chunks to make,
     and the amount of days stored in a list of blocks for each chunk, the
     following function divides the users date range to combat the 500 response
-    limit. The max amount of days in a range per request is 75.
+    limit. The max amount of days in a range per request is 75. Exact
+    institution names in org_names are sent as criteria so the API only
+    returns those institutions.
     """
 
+    if org_names is None:
+        org_names = list(ALL_UNIVERSITIES.keys())
+
     api_calls = []
     timeDict ={}
     timeList= []
@@ -91,7 +86,7 @@ def splitDateRange(origin,N,blocks):
             "criteria":
             {
                 "project_start_date": { "from_date": str(timeDict[x][0].date()), "to_date": str(timeDict[x][1].date()) },
-                "org_names": ["UNIVERSITY OF TEXAS","University of TX","UT SOUTHWESTERN MEDICAL CENTER"]
+                "org_names_exact_match": org_names
             },
                 "limit": 500,
                 "offset":0,
@@ -102,36 +97,66 @@ def splitDateRange(origin,N,blocks):
 
     return api_calls
 
-def findAllProjects(start,end,calls):
+def splitPIBatches(calls,pi_names,batch_size=PI_BATCH):
+
+    """
+    Given the date range payloads from splitDateRange and a list of (first name,
+    last name) pairs, return one payload per date range and batch of up to
+    batch_size PI names, so only awards of those PIs are returned.
+    """
+
+    api_calls = []
+    for call in calls:
+        for batch in partition(pi_names, batch_size):
+            payload = json.loads(json.dumps(call))
+            payload["criteria"]["pi_names"] = [{"first_name": first, "last_name": last} for first, last in batch]
+            api_calls.append(payload)
+    return api_calls
+
+def findAllProjects(start,end,calls,inst_filter=None,session=None,jobs=1):
 
     """
     Given a start date, end date, and a list of json payloads the function makes 
-    a POST call to NIH API for each payload. Each payload is given a date range and a 
-    list of strings for the query. Data from the response is parsed and appended to our 
-    list of formatted objects. North Texas results are removed.
+    a POST call to NIH API for each payload, jobs at a time. Each payload is given a
+    date range and a list of strings for the query. Data from the response is parsed
+    and appended to our list of formatted objects. Awards returned by more than one
+    payload are kept once, and results from institutions that do not pass the
+    institution filter are removed.
     """
 
+    if inst_filter is None:
+        inst_filter = build_filter()
+    if session is None:
+        from http_client import make_session
+        session = make_session()
+
     all_results = []
-    results = []
 
-    for x in calls:
-        response = requests.post(URL, json = x).json()
+    def post(x):
+        try:
+            response = session.post(URL, json = x).json()
+        except Exception as e:
+            logging.error(f'request failed because {e}')
+            sys.exit()
         temp = response["results"]
         assert(len(temp) < 500), "The date range provided too many results, please provide a block smaller than 75 days."
-        results += temp
+        return temp
+
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        responses = list(executor.map(post, calls))
+
+    # Date ranges share a day at their edges, so drop repeated awards
 
-    for y in results:
-        if(results.count(y) > 1):
-            assert("Duplicates in the response")
+    results = list({y["appl_id"]: y for temp in responses for y in temp}.values())
     
     logging.info(f"START: {start} END: {end}")
-    logging.info(f'Before removing North Texas: {len(results)}')
+    logging.info(f'Before institution filter: {len(results)}')
 
     for x in results:
 
-        # Remove all of North Texas Results
+        # Remove anything the API matched outside of our institutions
 
-        if ('NORTH' in x['organization']['org_name']):
+        if not inst_filter.matches(x['organization']['org_name']):
             logging.info(f"REMOVING: {x['organization']['org_name']}")
             continue
 
@@ -175,221 +200,231 @@ def findAllProjects(start,end,calls):
 
         all_results.append(myObj)
 
-    logging.info(f'After removing North Texas: {len(all_results)}')
+    logging.info(f'After institution filter: {len(all_results)}')
     return all_results
 
-def findTACCUsers(userlist,output,awards):
+def match_tacc_user(item, name_dict):
 
     """
-    Given a list of award information and a list of TACC usernames, write
-    an output workbook with two worksheets: (1) Awards that match a TACC username
-    and (2) awards that don't match a TACC username.
+    Given one award and the TACC userlist, decide where the award goes. Returns a
+    dictionary with the kind of match ('pi', 'collab', 'fuzzy' or None), the
+    matching userlist entry, the collaborators found in the userlist, and the
+    fuzzy name counts for logging.
     """
 
-    userlist_wb = load_workbook(filename=userlist, read_only=True)
-    worksheet = userlist_wb['utrc_institution_accounts']
-    row_count = worksheet.max_row
-    rows = worksheet.rows
-
-    name_dict = {}
-
-    if row_count > 1:
-        next(rows) # skip header row
-        for row in rows:
-            institution = row[0].value
-            first_name = row[1].value
-            last_name = row[2].value
-            name = ' '.join([first_name, last_name]).lower().replace(' ','')
-            name_dict[name] = [institution, first_name, last_name]
-
-    logging.info(f'number of items in name_dict = {len(name_dict.keys())}')
+    match = {
+        'kind': None,
+        'user': None,
+        'collabs': [],
+        'collab_fuzzy': False,
+        'fuzzy': False,
+        'fuzzy_names': 0,
+        'saved_names': 0,
+    }
+
+    name_str = full_key(item['piFirstName'], item['piLastName'])
+    first_name_str = first_key(item['piFirstName'])
+    last_name_str = item['piLastName'].lower()
+    affiliation = item['awardeeName']
+
+    collaborators = []
+    formattedCollab = match['collabs']
+    collabUsers = []
+
+    if(item['coPDPI']!= "NO DATA AVAILABLE"):
+        collaborators = item['coPDPI']
+
+    # If a collaborator is in the TACC system, save it for proper formatting.
+    # Check for fuzzywuzzy name matching on collaborators.
+        
+    if(collaborators):
+        for z in collaborators:
+            user = name_dict.lookup(z['first_name'], z['last_name'])
+            if user is not None:
+                formattedCollab.append(z['first_name'] + " " + z['last_name'])
+                collabUsers.append(user)
+            else:
+                collab_first = first_key(z['first_name'])
+                for _, x_first, x in name_dict.candidates(z['last_name']):
+                    y = ratio(collab_first,x_first)
+                    if(y >= 89 and y < 100 ):
+                        match['fuzzy_names'] += 1
+                        match['saved_names'] += 1
+                        logging.warning(f"Collaborator {z['first_name']} {z['last_name']} was found based on fuzzywuzzy ratio")
+                        formattedCollab.append(x[1] + " " + x[2])
+                        collabUsers.append(x)
+                        match['collab_fuzzy'] = True
+
+    # If the name matches one in our TACC system, it goes to the found sheet. 
+
+    user = name_dict.lookup(item['piFirstName'], item['piLastName'])
+    if user is not None:
+        logging.info(f'{name_str} matches {user}')
+        match['kind'] = 'pi'
+        match['user'] = user
+
+    # If the name does not match one in our TACC system, but a collaborator does, it
+    # goes to the found sheet.
+
+    elif formattedCollab:
+        match['kind'] = 'collab'
+        match['user'] = collabUsers[0]
+
+    # If the name does not match one in our TACC system, we will search through names that have an exact 
+    # last name match. The first name will be compared using fuzzywuzzy word matching. If this returns 
+    # a score of 89 or higher, we will pass the PI as a match.
+
+    else:
+        logging.info(f'{name_str} has no match')
+
+        for _, x_first, x in name_dict.candidates(item['piLastName']):
+            y = ratio(first_name_str,x_first)
+            if(y >= 80):
+                match['fuzzy_names'] += 1
+                match['fuzzy'] = True
+                logging.warning(f"Ratio of {y} for {first_name_str} {last_name_str} and {x[1].lower()} {x[2].lower()}")
+                logging.warning(f"PI Affiliation: {affiliation} && TACC User Affiliation: {x[0]}")
+                if(y >= 89 and y < 100 ):
+                    match['saved_names'] += 1
+                    logging.warning(f"Moving {first_name_str} {last_name_str} into sheet (i) based on fuzzywuzzy ratio")
+                    if match['kind'] is None:
+                        match['kind'] = 'fuzzy'
+                        match['user'] = x
+
+    return match
+
+def findTACCUsers(output,awards,matches,table=False, changes=None):
 
-    workbook = xlsxwriter.Workbook(output)
-    bold = workbook.add_format({'bold': 1})
-    found_worksheet = workbook.add_worksheet('utrc_nih_funding')
-    found_worksheet.write_row(0, 0, ['utrc_institution', 'utrc_first_name', 'utrc_last_name']+AWARD_INFO, bold)
-    not_found_worksheet = workbook.add_worksheet('not_utrc_nih_funding')
-    not_found_worksheet.write_row(0, 0, AWARD_INFO, bold)
+    """
+    Given a list of award information and the match for each award, write
+    an output workbook with two worksheets: (1) Awards that match a TACC username
+    and (2) awards that don't match a TACC username.
+    """
 
-    f_format = workbook.add_format({'bg_color':'#90EE90'})
-    nf_format = workbook.add_format({'bg_color':'#FCC981'})
+    report = ReportWriter(output, table)
+    report.add_sheet('utrc_nih_funding', ['utrc_institution', 'utrc_first_name', 'utrc_last_name']+AWARD_INFO)
+    report.add_sheet('not_utrc_nih_funding', AWARD_INFO)
 
-    f_row = 1
-    nf_row = 1
     fuzzy_names = 0
     saved_names = 0
 
-    for item in awards:    
-        collab_format = workbook.add_format({'font_color':'red'})
-
-        name_str = item['piFirstName'].lower() + item['piLastName'].lower()
-        name_str = name_str.replace(" ", "")
-        first_name_str = item['piFirstName'].lower()
-        last_name_str = item['piLastName'].lower()
-        affiliation = item['awardeeName']
-
-        collaborators = []
-        formattedCollab = []
-        collab_str = ""
-
-        if(item['coPDPI']!= "NO DATA AVAILABLE"):
-            collaborators = item['coPDPI']
-
-        # If a collaborator is in the TACC system, save it for proper formatting.
-        # Check for fuzzywuzzy name matching on collaborators.
-            
-        if(collaborators):
-            for z in collaborators:
-                collab_str = z['first_name'].lower() + z['last_name'].lower()
-                if collab_str in name_dict.keys():
-                    formattedCollab.append(z['first_name'] + " " + z['last_name'])
-                else:
-                    for x in name_dict:
-                        if(z['last_name'].lower() != name_dict[x][2].lower()):
-                            continue
-                        y = fuzz.ratio(z['first_name'].lower(),name_dict[x][1].lower())
-                        if(y >= 89 and y < 100 ):
-                            fuzzy_names += 1
-                            saved_names += 1
-                            logging.warning(f"Collaborator {z['first_name']} {z['last_name']} was found based on fuzzywuzzy ratio")
-                            formattedCollab.append(name_dict[x][1] + " " + name_dict[x][2])
-                            collab_format = workbook.add_format({'bg_color': '#90EE90', 'font_color' : 'red'})
-
-
-        # If the name matches one in our TACC system, add it to the found sheet. 
+    for item, match in zip(awards, matches):    
+        fuzzy_names += match['fuzzy_names']
+        saved_names += match['saved_names']
+        formattedCollab = match['collabs']
+        user = match['user']
+
+        if match['collab_fuzzy']:
+            collab_format = 'found_collab'
+        else:
+            collab_format = 'collab'
+
+        # If the PI is in our TACC system, add it to the found sheet. 
         # If the collaborators are in our TACC systems, highlight their names red.
 
-        if name_str in name_dict.keys():
-            logging.info(f'{name_str} matches {name_dict[name_str]}')
-            found_worksheet.write_row(f_row, 0, [name_dict[name_str][0],
-                                                name_dict[name_str][1],
-                                                name_dict[name_str][2],
-                                                item['id'],
-                                                item['agency'],
-                                                item['awardeeName'],
-                                                item['startDate'],
-                                                item['expDate'],
-                                                item['estimatedTotalAmt'],
-                                                item['piFirstName'],
-                                                item['piLastName'],
-                                                item['pdPIName'],
-                                                item['title'],
-                                                json.dumps(item['coPDPI'])
-                                                ])
+        if match['kind'] == 'pi':
+            row = [user[0],
+                   user[1],
+                   user[2],
+                   item['id'],
+                   item['agency'],
+                   item['awardeeName'],
+                   item['startDate'],
+                   item['expDate'],
+                   item['estimatedTotalAmt'],
+                   item['piFirstName'],
+                   item['piLastName'],
+                   item['pdPIName'],
+                   item['title'],
+                   json.dumps(item['coPDPI'])
+                   ]
             if(formattedCollab):
-                found_worksheet.write(f_row,14,json.dumps(formattedCollab),collab_format)
+                report.append('utrc_nih_funding', row + [json.dumps(formattedCollab)],
+                              cell_formats={14: collab_format})
             else:
-                found_worksheet.write(f_row,14,"None Found")
-            f_row += 1
-
-        # If the name does not match one in our TACC system, but a collaborator does, add it to
-        # the found sheet. Collaborator will be highlighted in red.
-
-        elif formattedCollab:
-            found_worksheet.write_row(f_row, 0, [name_dict[formattedCollab[0].lower().replace(" ","")][0],
-                                                item['piFirstName'],
-                                                item['piLastName'],
-                                                item['id'],
-                                                item['agency'],
-                                                item['awardeeName'],
-                                                item['startDate'],
-                                                item['expDate'],
-                                                item['estimatedTotalAmt'],
-                                                item['piFirstName'],
-                                                item['piLastName'],
-                                                item['pdPIName'],
-                                                item['title'],
-                                                ])
-            found_worksheet.write(f_row,13,json.dumps(item['coPDPI']),collab_format)
-            found_worksheet.write(f_row,14,json.dumps(formattedCollab),collab_format)
-            f_row += 1
-
-        # If the name does not match one in our TACC system, we will search through names that have an exact 
-        # last name match. The first name will be compared using fuzzywuzzy word matching. If this returns 
-        # a score of 89 or higher, we will pass the PI as a match.
+                report.append('utrc_nih_funding', row + ["None Found"])
+
+        # If only a collaborator is in our TACC system, add it to the found sheet.
+        # Collaborator will be highlighted in red.
+
+        elif match['kind'] == 'collab':
+            report.append('utrc_nih_funding', [user[0],
+                                               item['piFirstName'],
+                                               item['piLastName'],
+                                               item['id'],
+                                               item['agency'],
+                                               item['awardeeName'],
+                                               item['startDate'],
+                                               item['expDate'],
+                                               item['estimatedTotalAmt'],
+                                               item['piFirstName'],
+                                               item['piLastName'],
+                                               item['pdPIName'],
+                                               item['title'],
+                                               json.dumps(item['coPDPI']),
+                                               json.dumps(formattedCollab)
+                                               ], cell_formats={13: collab_format, 14: collab_format})
+
+        # If the PI passed the fuzzywuzzy check, add it to the found sheet highlighted green.
+
+        elif match['kind'] == 'fuzzy':
+            report.append('utrc_nih_funding', [user[0],
+                                               user[1],
+                                               user[2],
+                                               item['id'],
+                                               item['agency'],
+                                               item['awardeeName'],
+                                               item['startDate'],
+                                               item['expDate'],
+                                               item['estimatedTotalAmt'],
+                                               item['piFirstName'],
+                                               item['piLastName'],
+                                               item['pdPIName'],
+                                               item['title'],
+                                               json.dumps(item['coPDPI']),
+                                               "None Found"
+                                               ], 'found')
+
+        # Otherwise add it to the not found sheet, highlighted orange if the
+        # fuzzywuzzy check came close.
 
         else:
-            logging.info(f'{name_str} has no match')
-            
-            fuzzy = False
-            following = True
-            added = False
-
-            for x in name_dict:
-                if(last_name_str != name_dict[x][2].lower()):
-                    continue
-                y = fuzz.ratio(first_name_str,name_dict[x][1].lower())
-                if(y >= 80):
-                    fuzzy_names += 1
-                    fuzzy = True
-                    logging.warning(f"Ratio of {y} for {first_name_str} {last_name_str} and {name_dict[x][1].lower()} {name_dict[x][2].lower()}")
-                    logging.warning(f"PI Affiliation: {affiliation} && TACC User Affiliation: {name_dict[x][0]}")
-                    if(y >= 89 and y < 100 ):
-                        saved_names += 1
-                        logging.warning(f"Moving {first_name_str} {last_name_str} into sheet (i) based on fuzzywuzzy ratio")
-                        if  not added:
-                            found_worksheet.write_row(f_row, 0, [name_dict[x][0],
-                                                        name_dict[x][1],
-                                                        name_dict[x][2],
-                                                        item['id'],
-                                                        item['agency'],
-                                                        item['awardeeName'],
-                                                        item['startDate'],
-                                                        item['expDate'],
-                                                        item['estimatedTotalAmt'],
-                                                        item['piFirstName'],
-                                                        item['piLastName'],
-                                                        item['pdPIName'],
-                                                        item['title'],
-                                                        json.dumps(item['coPDPI']),
-                                                        "None Found"
-                                                        ],f_format)
-                            f_row += 1
-                            following = False
-                            added = True
-                    
-                        
-            if following:
-                if fuzzy:
-                    format = nf_format
-                else:
-                    format = None
-
-                not_found_worksheet.write_row(nf_row, 0,[ item['id'],
-                                                            item['agency'],
-                                                            item['awardeeName'],
-                                                            item['startDate'],
-                                                            item['expDate'],
-                                                            item['estimatedTotalAmt'],
-                                                            item['piFirstName'],
-                                                            item['piLastName'],
-                                                            item['pdPIName'],
-                                                            item['title'],
-                                                            json.dumps(item['coPDPI']),
-                                                            "None Found"
-                                                        ], format)                                                       
-                nf_row += 1
-
-    found = f_row - 1
-    notFound = nf_row - 1  
+            report.append('not_utrc_nih_funding', [item['id'],
+                                                   item['agency'],
+                                                   item['awardeeName'],
+                                                   item['startDate'],
+                                                   item['expDate'],
+                                                   item['estimatedTotalAmt'],
+                                                   item['piFirstName'],
+                                                   item['piLastName'],
+                                                   item['pdPIName'],
+                                                   item['title'],
+                                                   json.dumps(item['coPDPI']),
+                                                   "None Found"
+                                                   ], 'maybe' if match['fuzzy'] else None)
+
+    found = report.rows('utrc_nih_funding')
+    notFound = report.rows('not_utrc_nih_funding')
     if(notFound != 0):
         logging.info("TACC Percentage: {:.2f}".format(float(found/notFound) * 100) + "%")
     logging.info(f'Total fuzzy names: {fuzzy_names}' )
     logging.info(f'Fuzzy names saved: {saved_names}' )
 
-    workbook.close()
+    if changes is not None:
+        write_changes(report, 'nih', awards, changes)
+    report.close()
     return
 
 
-def main():
+def harvest(args, name_dict=None):
 
-    parser = argparse.ArgumentParser(description='Scrape NSF funded awards')
-    parser.add_argument('-s', '--start', dest='start_date', help='range start date, format = YYYYMMDD', required=True)
-    parser.add_argument('-e', '--end', dest='end_date', help='range start date, format = YYYYMMDD', required=True)
-    parser.add_argument('-i', '--institution', dest='inst', help='institution search term, format = University+of+Texas', required=True)
-    parser.add_argument('-u', '--userlist', dest='userlist', help='input file with list of names and affiliations', required=True)
-    parser.add_argument('-o', '--output', dest='output', help='output file', required=True)
-    args = parser.parse_args()
+    """
+    Find all NIH awards for the command line arguments (see cli). With --by-pi,
+    only awards of PIs in the userlist (name_dict) are requested. Returns a
+    list of formatted award objects.
+    """
+
+    inst_filter = build_filter(args.inst_map)
 
     start = str(args.start_date)[0:4] + "-" + str(args.start_date)[4:6] + "-" + str(args.start_date)[6:]
     end = str(args.end_date)[0:4] + "-" + str(args.end_date)[4:6] + "-" + str(args.end_date)[6:]
@@ -406,13 +441,23 @@ def main():
     n = math.ceil(days/groups)
     chunks = list(partition(l,n))
     
-    # split user inputted date range, get all NIH awards, match TACC Users
-    api_calls = []
-    all_awards = []
+    # split user inputted date range, get all NIH awards
 
-    api_calls = splitDateRange(origin, groups, chunks)
-    all_awards = findAllProjects(start,end,api_calls)
-    findTACCUsers('/data/' + args.userlist, '/data/' + f'NIH_{args.output}', all_awards)
+    api_calls = splitDateRange(origin, groups, chunks, inst_filter.org_names())
+    if args.by_pi:
+        pi_names = list(dict.fromkeys((x[1], x[2]) for x in name_dict.values()))
+        api_calls = splitPIBatches(api_calls, pi_names)
+    return findAllProjects(start,end,api_calls,inst_filter,jobs=args.jobs)
+
+def match(awards, name_dict, processes=None):
+    return match_awards(match_tacc_user, awards, name_dict, processes)
+
+def write_report(awards, matches, output, table=False, changes=None):
+    findTACCUsers(output, awards, matches, table, changes)
+
+def main():
+    import cli
+    cli.main(['nih'] + sys.argv[1:])
 
 if __name__ == '__main__':
     main()
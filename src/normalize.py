@@ -0,0 +1,155 @@
+#
+# Name normalization used for matching award PIs to the TACC userlist. Names
+# are folded to plain lower case ASCII without punctuation or suffixes, and
+# each name gets several lookup keys so that "José A. Pérez-Díaz Jr." on an
+# award finds "Jose Perez-Diaz" in the userlist without a fuzzy scan.
+#
+import re
+import unicodedata
+
+
+SUFFIXES = {'jr', 'sr', 'ii', 'iii', 'iv', 'v', 'phd', 'md', 'dds', 'dvm', 'esq'}
+
+_PUNCTUATION = re.compile(r"[^\w\s]|_")
+
+# Letters that NFKD does not split into a base letter and an accent
+_LETTERS = str.maketrans({'ø': 'o', 'ł': 'l', 'đ': 'd', 'ð': 'd', 'ħ': 'h', 'ı': 'i',
+                          'æ': 'ae', 'œ': 'oe', 'ß': 'ss', 'þ': 'th'})
+
+
+def fold(text):
+    """
+    Lower case, strip accents and turn punctuation into spaces. Returns a list
+    of the remaining words.
+    """
+
+    if not text:
+        return []
+    text = unicodedata.normalize('NFKD', str(text))
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    text = _PUNCTUATION.sub(' ', text.replace("'", '').lower().translate(_LETTERS))
+    return text.split()
+
+
+def _strip_suffixes(words):
+    """
+    Drop suffixes such as "jr" or "phd" from the end of a last name, keeping
+    at least one word.
+    """
+
+    while len(words) > 1 and words[-1] in SUFFIXES:
+        words = words[:-1]
+    return words
+
+
+def split_name(first_name, last_name):
+    """
+    Return (first, middle, last) word lists with suffixes dropped from the end
+    of the last name. Everything after the first word of the first name counts
+    as middle names.
+    """
+
+    first = fold(first_name)
+    last = _strip_suffixes(fold(last_name))
+    return first[:1], first[1:], last
+
+
+def name_keys(first_name, last_name):
+    """
+    Return the lookup keys for a name as (full, plain, initial):
+    first + middle + last, first + last, and first initial + last.
+    Returns None if there is no last name.
+    """
+
+    first, middle, last = split_name(first_name, last_name)
+    if not last:
+        return None
+    last = ''.join(last)
+    if not first:
+        return (last, last, last)
+    return (''.join(first + middle) + last, first[0] + last, first[0][0] + last)
+
+
+def full_key(first_name, last_name):
+    keys = name_keys(first_name, last_name)
+    return keys[0] if keys else ''
+
+
+def first_key(first_name):
+    return ' '.join(fold(first_name))
+
+
+def last_key(last_name):
+    return ''.join(_strip_suffixes(fold(last_name)))
+
+
+class NameIndex(dict):
+    """
+    The TACC userlist, keyed by full_key, with hash indexes built once for
+    matching:
+
+      by_name     first + last key (no middle) -> entries
+      by_initial  first initial + last key -> entries
+      initials    the same, only for entries whose first name is an initial
+      by_last     last name key -> [(full key, first name key, entry), ...]
+                  for fuzzy scans
+
+    Entries are [institution, first name, last name] as read from the userlist.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.by_name = {}
+        self.by_initial = {}
+        self.initials = {}
+        self.by_last = {}
+
+    def add(self, institution, first_name, last_name):
+        entry = [institution, first_name, last_name]
+        keys = name_keys(first_name, last_name)
+        if not keys:
+            return
+        full, plain, initial = keys
+        if full in self:
+            return
+        self[full] = entry
+        self.by_name.setdefault(plain, []).append(entry)
+        self.by_initial.setdefault(initial, []).append(entry)
+        if plain == initial:
+            self.initials.setdefault(initial, []).append(entry)
+        self.by_last.setdefault(last_key(last_name), []).append((full, first_key(first_name), entry))
+
+    def lookup(self, first_name, last_name):
+        """
+        Return the userlist entry for a name, or None. Tries the full name, then
+        first + last without middle names. If either side only has a first
+        initial, first initial + last is used. The last two only count when
+        exactly one userlist entry has the key; ambiguous names are left to
+        the fuzzy scan.
+        """
+
+        keys = name_keys(first_name, last_name)
+        if not keys:
+            return None
+        full, plain, initial = keys
+        if full in self:
+            return self[full]
+        if plain in self.by_name:
+            candidates = self.by_name[plain]
+        elif plain == initial:
+            # Award has only an initial: any userlist first name will do
+            candidates = self.by_initial.get(initial, [])
+        else:
+            # Userlist has only an initial
+            candidates = self.initials.get(initial, [])
+        if len(candidates) == 1:
+            return candidates[0]
+        return None
+
+    def candidates(self, last_name):
+        """
+        Return [(full key, first name key, entry), ...] for userlist entries
+        with the same last name, the only ones worth a fuzzy comparison.
+        """
+
+        return self.by_last.get(last_key(last_name), [])
@@ -3,16 +3,17 @@
 # For NSF API docs, see:
 # https://www.research.gov/common/webapi/awardapisearch-v1.htm
 #
-import argparse
 import datetime
 import logging
 import sys
 import json
-import requests
-from requests.adapters import HTTPAdapter
-from openpyxl import load_workbook
-import xlsxwriter
-from fuzzy_match import fuzzy_match
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote_plus
+from fuzzy_match import match_name, write_match
+from report_writer import ReportWriter
+from award_diff import write_changes
+from institution_filter import build_filter, load_institution_terms
+from matching import match_awards
 
 
 logging.basicConfig(level=logging.WARNING)
@@ -34,33 +35,43 @@ AWARD_INFO=['id',
            ]
 
 
-def search_by_date_range(start, end, institution):
+def search_by_date_range(start, end, institution, inst_filter=None, session=None, pi_name=None):
     """
     Search by a range of dates and award institution name. Returns a list of award
     IDs matching the institution and that started within the range of dates.
+    If an institution filter is given, awards whose awardeeName does not pass it
+    are dropped here, before their award information is retrieved. If a PI name
+    is given, only that PI's awards (pdPIName) at the institution are searched.
 
     Date format: 'mm/dd/yyyy'
-    Institution format: '"Name+of+Institution"'
+    Institution format: 'Name of Institution'
+    PI name format: 'First Last'
     """
 
+    import requests
+    from http_client import make_session
+
     offset_value = 1
     award_id_list = []
+    if session is None:
+        session = make_session()
 
     while True:
         logging.info(f'searching with offset_value = {offset_value}')
+        search_term = ''.join(['awardeeName="', quote_plus(institution), '"'])
+        if pi_name is not None:
+            search_term += ''.join(['&pdPIName="', quote_plus(pi_name), '"'])
         query_parameters = ''.join([ '?', 'startDateStart=', start, 
                                      '&', 'startDateEnd=', end,
-                                     '&', 'awardeeName="', institution, '"',
+                                     '&', search_term,
                                      '&', 'offset=', str(offset_value) ])
+        if inst_filter is not None:
+            query_parameters += '&printFields=id,awardeeName'
         
-        http = requests.Session()
-        adapter = HTTPAdapter(max_retries=5)
-        adapter.max_retries.respec_retry_after_header = False
-        http.mount('http://', adapter)
         query_url = ''.join([SEARCH_URL, query_parameters])
         logging.info(f'getting {query_url}')
         try:
-            response = http.get(query_url, timeout=20)
+            response = session.get(query_url, timeout=20)
         except requests.exceptions.ReadTimeout:
             print('timeout during search...try again later')
             sys.exit()
@@ -70,90 +81,131 @@ def search_by_date_range(start, end, institution):
 
         logging.info(f'response was {response.ok}')
 
-        for i in range(len(response.json()['response']['award'])):
-            award_id_list.append(response.json()['response']['award'][i]['id'])
+        awards = response.json()['response']['award']
+        for award in awards:
+            if inst_filter is not None and not inst_filter.matches(award.get('awardeeName')):
+                logging.info(f"REMOVING: {award.get('awardeeName')}")
+                continue
+            award_id_list.append(award['id'])
 
         logging.debug(award_id_list)
-        if len(response.json()['response']['award']) == 25:
+        if len(awards) == 25:
             offset_value += 25
             continue
         else:
             logging.info(f'{len(award_id_list)} awards found')
             return award_id_list
 
+
+def search_institutions(start, end, institutions, inst_filter=None, session=None, jobs=4):
+    """
+    Run search_by_date_range for each institution term concurrently over one
+    pooled session. Returns the merged list of award IDs with duplicates (awards
+    matched by more than one term) removed, in institution order.
+    """
+
+    if session is None:
+        from http_client import make_adapter, make_session
+        session = make_session(make_adapter(pool_size=max(jobs, 1)))
+
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        id_lists = list(executor.map(
+            lambda inst: search_by_date_range(start, end, inst, inst_filter, session),
+            institutions))
+
+    award_id_list = list(dict.fromkeys(x for id_list in id_lists for x in id_list))
+    logging.info(f'{len(award_id_list)} unique awards found for {len(institutions)} institutions')
+    return award_id_list
+
+
+def search_pis(start, end, pi_names, institutions, inst_filter=None, session=None, jobs=4):
+    """
+    Search by PI name within the institutions: run search_by_date_range for
+    each name in pi_names and each institution term concurrently over one
+    pooled session. The API takes a single pdPIName per query, so names cannot
+    be batched. Returns the merged list of award IDs with duplicates removed.
+    """
+
+    if session is None:
+        from http_client import make_adapter, make_session
+        session = make_session(make_adapter(pool_size=max(jobs, 1)))
+
+    searches = [(pi_name, inst) for pi_name in pi_names for inst in institutions]
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        id_lists = list(executor.map(
+            lambda search: search_by_date_range(start, end, search[1], inst_filter, session, search[0]),
+            searches))
+
+    award_id_list = list(dict.fromkeys(x for id_list in id_lists for x in id_list))
+    logging.info(f'{len(award_id_list)} unique awards found for {len(pi_names)} PIs')
+    return award_id_list
+
     
-def retrieve_award_info(award_id_list):
+def retrieve_award(item, session):
     """
     Retrieve specific award information given an award ID. The information returned
     is in the AWARD_INFO list.
     """
 
-    award_dict = {}
-    print_fields = ','.join(AWARD_INFO)
+    import requests
 
-    for item in award_id_list:
-        http = requests.Session()
-        adapter = HTTPAdapter(max_retries=5)
-        adapter.max_retries.respec_retry_after_header = False
-        http.mount('http://', adapter)
-        query_parameters = ''.join(['?', 'printFields=', print_fields])
-        logging.info(f'getting {RETRIEVE_URL}{item}.json{query_parameters}')
-        try:
-            response = http.get(url=RETRIEVE_URL + item + '.json' + query_parameters, timeout=20)
-        except requests.exceptions.ReadTimeout:
-            print('timeout during award lookup...try again later')
-            sys.exit()
-        except Exception as x:
-            print(f'request failed because {x}')
-            sys.exit()
+    print_fields = ','.join(AWARD_INFO)
+    query_parameters = ''.join(['?', 'printFields=', print_fields])
+    logging.info(f'getting {RETRIEVE_URL}{item}.json{query_parameters}')
+    try:
+        response = session.get(url=RETRIEVE_URL + item + '.json' + query_parameters, timeout=20)
+    except requests.exceptions.ReadTimeout:
+        print('timeout during award lookup...try again later')
+        sys.exit()
+    except Exception as x:
+        print(f'request failed because {x}')
+        sys.exit()
 
-        logging.info(f'response was {response.ok}')
+    logging.info(f'response was {response.ok}')
 
-        award_dict[item] = response.json()['response']['award'][0]
+    award = response.json()['response']['award'][0]
 
-        for field in AWARD_INFO:
-            if field not in award_dict[item]:
-                award_dict[item][field] = 'NO DATA AVAILABLE' 
-    return award_dict
+    for field in AWARD_INFO:
+        if field not in award:
+            award[field] = 'NO DATA AVAILABLE' 
+    return award
 
 
-def write_output_sheet(award_dict, userlist, output):
+def retrieve_award_info(award_id_list, session=None, jobs=4):
     """
-    Given a dictionary of award information and a list of TACC usernames, write
-    an output workbook with two worksheets: (1) Awards that match a TACC username
-    and (2) awards that don't match a TACC username.
+    Retrieve award information for every award ID, jobs at a time over one
+    pooled session. Returns a dictionary of award ID to award information.
     """
 
-    userlist_wb = load_workbook(filename=userlist, read_only=True)
-    worksheet = userlist_wb['utrc_institution_accounts']
-    row_count = worksheet.max_row
-    rows = worksheet.rows
+    if session is None:
+        from http_client import make_adapter, make_session
+        session = make_session(make_adapter(pool_size=max(jobs, 1)))
 
-    name_dict = {}
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        awards = executor.map(lambda item: retrieve_award(item, session), award_id_list)
+        return dict(zip(award_id_list, awards))
 
-    if row_count > 1:
-        next(rows) # skip header row
-        for row in rows:
-            institution = row[0].value
-            first_name = row[1].value
-            last_name = row[2].value
-            utrc_full_name = ' '.join([first_name, last_name]).lower().replace(' ','')
-            name_dict[utrc_full_name] = [institution, first_name, last_name]
 
-    logging.info(f'number of items in name_dict = {len(name_dict.keys())}')
+def match_award(item, name_dict):
+    """
+    Match one award's PI against the TACC userlist (see fuzzy_match.match_name).
+    """
 
-    workbook = xlsxwriter.Workbook(output)
-    bold = workbook.add_format({'bold': 1})
-    found_worksheet = workbook.add_worksheet('utrc_nsf_funding')
-    found_worksheet.write_row(0, 0, ['utrc_institution', 'utrc_first_name', 'utrc_last_name']+AWARD_INFO, bold)
-    not_found_worksheet = workbook.add_worksheet('not_utrc_nsf_funding')
-    not_found_worksheet.write_row(0, 0, AWARD_INFO, bold)
+    return match_name(logging, item['piFirstName'], item['piLastName'], name_dict)
 
-    f_row = 1
-    nf_row = 1
-    
-    for entry in award_dict.items():
-        item = entry[1]
+
+def write_output_sheet(awards, matches, output, table=False, changes=None):
+    """
+    Given a list of award information and the match for each award, write
+    an output workbook with two worksheets: (1) Awards that match a TACC username
+    and (2) awards that don't match a TACC username.
+    """
+
+    report = ReportWriter(output, table)
+    report.add_sheet('utrc_nsf_funding', ['utrc_institution', 'utrc_first_name', 'utrc_last_name']+AWARD_INFO)
+    report.add_sheet('not_utrc_nsf_funding', AWARD_INFO)
+
+    for item, match in zip(awards, matches):
         base_info = [item['id'],
                      item['agency'],
                      item['awardeeName'],
@@ -165,49 +217,52 @@ def write_output_sheet(award_dict, userlist, output):
                      item['pdPIName'],
                      json.dumps(item['coPDPI']),
                      item['title']]
-        award_full_name = ' '.join([item['piFirstName'], item['piLastName']]).lower().replace(' ', '')
-        if award_full_name in name_dict.keys():
-            logging.info(f'{award_full_name} matches {name_dict[award_full_name]}')
-            found_worksheet.write_row(f_row, 0, [name_dict[award_full_name][0],
-                                                 name_dict[award_full_name][1],
-                                                 name_dict[award_full_name][2]
-                                                ] + base_info)
-            f_row += 1
-        else:
-            fuzzycheck = fuzzy_match(logging, item['piLastName'], name_dict, found_worksheet,
-                                     not_found_worksheet, award_full_name,
-                                     base_info, workbook, f_row, nf_row)
-
-            if fuzzycheck is False:
-                nf_row += 1
-            else:
-                f_row += 1
+        write_match(report, 'utrc_nsf_funding', 'not_utrc_nsf_funding', match, base_info)
 
-    workbook.close()
+    if changes is not None:
+        write_changes(report, 'nsf', awards, changes)
+    report.close()
     return
-    
 
 
-def main():
+def harvest(args, name_dict=None):
+    """
+    Search and retrieve all awards for the command line arguments (see cli).
+    With --by-pi, search for each PI in the userlist (name_dict) at each
+    institution. Returns a list of award information.
+    """
 
-    parser = argparse.ArgumentParser(description='Scrape NSF funded awards')
-    parser.add_argument('-s', '--start', dest='start_date', help='range start date, format = YYYYMMDD', required=True)
-    parser.add_argument('-e', '--end', dest='end_date', help='range start date, format = YYYYMMDD', required=True)
-    parser.add_argument('-i', '--institution', dest='inst', help='institution search term, format = University+of+Texas', required=True)
-    parser.add_argument('-u', '--userlist', dest='userlist', help='input file with list of names and affiliations', required=True)
-    parser.add_argument('-o', '--output', dest='output', help='output file', required=True)
-    args = parser.parse_args()
+    from http_client import make_adapter, make_session
+
+    institutions = load_institution_terms(args.inst, args.inst_file) or ['University of Texas']
+    # Terms may be given as "University+of+Texas"; they are encoded when sent
+    institutions = [x.replace('+', ' ') for x in institutions]
+    inst_filter = build_filter(args.inst_map) if args.inst_map else None
 
     start = datetime.datetime.strptime(args.start_date, '%Y%m%d').strftime('%m/%d/%Y')
     end = datetime.datetime.strptime(args.end_date, '%Y%m%d').strftime('%m/%d/%Y')
 
-    award_id_list = search_by_date_range(start, end, args.inst)
-    award_dict = retrieve_award_info(award_id_list)
-    write_output_sheet(award_dict, '/data/' + args.userlist, '/data/' + f'NSF_{args.output}')
+    session = make_session(make_adapter(pool_size=max(args.jobs, 1)))
+    if args.by_pi:
+        pi_names = list(dict.fromkeys(f'{x[1]} {x[2]}' for x in name_dict.values()))
+        award_id_list = search_pis(start, end, pi_names, institutions, inst_filter, session, args.jobs)
+    else:
+        award_id_list = search_institutions(start, end, institutions, inst_filter, session, args.jobs)
+    return list(retrieve_award_info(award_id_list, session, args.jobs).values())
 
-    return
+
+def match(awards, name_dict, processes=None):
+    return match_awards(match_award, awards, name_dict, processes)
+
+
+def write_report(awards, matches, output, table=False, changes=None):
+    write_output_sheet(awards, matches, output, table, changes)
+
+
+def main():
+    import cli
+    cli.main(['nsf'] + sys.argv[1:])
 
 
 if __name__ == '__main__':
     main()
-
@@ -0,0 +1,211 @@
+#
+# Per-host request throttling shared by all scrapers. Each host gets a token
+# bucket (requests per second), an adaptive concurrency limit (AIMD: grow by
+# one for every limit's worth of fast, clean responses, halve on 429/5xx or
+# slow responses) and a circuit breaker that holds back requests to a host
+# that keeps failing until it has had time to recover.
+#
+import logging
+import threading
+import time
+
+
+"""
+Per-host settings. NIH RePORTER asks for no more than one request per second.
+Hosts not listed here use DEFAULT_LIMITS.
+"""
+
+DEFAULT_LIMITS = {
+    'rate': 5.0,             # requests per second
+    'burst': 5,              # bucket size
+    'concurrency': 4,        # starting concurrent requests
+    'max_concurrency': 16,
+    'target_latency': 5.0,   # seconds; slower responses count as a throttle
+    'failure_threshold': 10, # consecutive failures before the circuit opens,
+                             # more than one request's retries (MAX_ATTEMPTS)
+    'reset_timeout': 30.0,   # seconds before a half-open trial request
+    'max_wait': 60.0,        # seconds one attempt waits for an open circuit
+}
+
+HOST_LIMITS = {
+    'api.nsf.gov': {'rate': 5.0, 'burst': 5},
+    'api.reporter.nih.gov': {'rate': 1.0, 'burst': 1, 'concurrency': 1, 'max_concurrency': 2},
+    'pamspublic.science.energy.gov': {'rate': 2.0, 'burst': 4, 'target_latency': 10.0},
+}
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of sending a request to a host whose circuit is open.
+    """
+
+
+class TokenBucket:
+    """
+    Allow rate requests per second on average, with bursts of up to burst.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class AdaptiveConcurrency:
+    """
+    Limit the number of requests in flight. The limit grows by 1/limit after
+    each clean response, so by one for every limit's worth of them, and is
+    halved on a throttle, between 1 and maximum.
+    """
+
+    def __init__(self, initial, maximum):
+        self.limit = initial
+        self.maximum = maximum
+        self._in_flight = 0
+        self._cond = threading.Condition()
+
+    def __enter__(self):
+        with self._cond:
+            while self._in_flight >= int(self.limit):
+                self._cond.wait()
+            self._in_flight += 1
+        return self
+
+    def __exit__(self, *exc):
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    def increase(self):
+        with self._cond:
+            self.limit = min(self.maximum, self.limit + 1 / max(int(self.limit), 1))
+            self._cond.notify_all()
+
+    def decrease(self):
+        with self._cond:
+            self.limit = max(1, self.limit / 2)
+
+
+class CircuitBreaker:
+    """
+    Open after failure_threshold consecutive failures. While open, requests
+    wait; after reset_timeout one trial request is let through, and its result
+    closes or re-opens the circuit. A request that has waited max_wait for the
+    circuit gets CircuitOpenError.
+    """
+
+    def __init__(self, host, failure_threshold, reset_timeout, max_wait):
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_wait = max_wait
+        self._failures = 0
+        self._opened = None
+        self._trial = False
+        self._cond = threading.Condition()
+
+    def wait(self):
+        """
+        Block until a request may be sent. Returns True if the caller holds the
+        half-open trial, which it must resolve with success(), failure() or
+        release().
+        """
+
+        deadline = time.monotonic() + self.max_wait
+        with self._cond:
+            while True:
+                if self._opened is None:
+                    return False
+                now = time.monotonic()
+                reopen = self._opened + self.reset_timeout
+                if now >= reopen and not self._trial:
+                    self._trial = True
+                    return True
+                if now >= deadline:
+                    raise CircuitOpenError(f'circuit for {self.host} still open after {self.max_wait:.0f}s')
+                # Woken early by the trial's result
+                self._cond.wait(min(deadline, reopen if reopen > now else deadline) - now)
+
+    def success(self):
+        with self._cond:
+            self._failures = 0
+            self._opened = None
+            self._trial = False
+            self._cond.notify_all()
+
+    def failure(self):
+        with self._cond:
+            self._failures += 1
+            if self._trial or self._failures >= self.failure_threshold:
+                if self._opened is None:
+                    logging.warning(f'circuit opened for {self.host}')
+                self._opened = time.monotonic()
+                self._trial = False
+                self._cond.notify_all()
+
+    def release(self):
+        """
+        Give up a trial that ended without a result (e.g. an invalid request),
+        so another request can be the trial.
+        """
+
+        with self._cond:
+            if self._trial:
+                self._trial = False
+                self._cond.notify_all()
+
+
+class HostLimiter:
+    """
+    The token bucket, concurrency limit and circuit breaker for one host.
+    """
+
+    def __init__(self, host, limits):
+        self.host = host
+        self.target_latency = limits['target_latency']
+        self.bucket = TokenBucket(limits['rate'], limits['burst'])
+        self.concurrency = AdaptiveConcurrency(limits['concurrency'], limits['max_concurrency'])
+        self.breaker = CircuitBreaker(host, limits['failure_threshold'], limits['reset_timeout'],
+                                      limits['max_wait'])
+
+    def success(self, latency):
+        self.breaker.success()
+        if latency > self.target_latency:
+            logging.info(f'{self.host} answered in {latency:.1f}s, backing off')
+            self.concurrency.decrease()
+        else:
+            self.concurrency.increase()
+
+    def throttled(self):
+        self.breaker.failure()
+        self.concurrency.decrease()
+        logging.info(f'{self.host} throttled, concurrency now {int(self.concurrency.limit)}')
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(host):
+    """
+    Return the shared HostLimiter for a host, creating it on first use.
+    """
+
+    with _limiters_lock:
+        if host not in _limiters:
+            _limiters[host] = HostLimiter(host, {**DEFAULT_LIMITS, **HOST_LIMITS.get(host, {})})
+        return _limiters[host]
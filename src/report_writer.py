@@ -0,0 +1,80 @@
+#
+# Output workbooks for the scrapers. The writer creates every format it needs
+# once, up front, and rows refer to them by name, so the workbook's format
+# table stays the same size however many awards are written.
+#
+
+
+PALETTE = {
+    'header': {'bold': 1},
+    'found': {'bg_color': '#90EE90'},
+    'maybe': {'bg_color': '#FCC981'},
+    'collab': {'font_color': 'red'},
+    'found_collab': {'bg_color': '#90EE90', 'font_color': 'red'},
+}
+
+
+class ReportWriter:
+    """
+    Write rows to the sheets of one output workbook, in order. Each row goes
+    straight to xlsxwriter, which in constant_memory mode flushes a sheet's
+    rows to disk as it goes, so big reports don't pile up in memory. On
+    close, each sheet gets an autofilter over its header row, or is turned
+    into an Excel table if table=True (tables need the default mode).
+    """
+
+    def __init__(self, output, table=False):
+        import xlsxwriter
+
+        self.workbook = xlsxwriter.Workbook(output, {'constant_memory': not table})
+        self.table = table
+        self.formats = {name: self.workbook.add_format(props) for name, props in PALETTE.items()}
+        self._sheets = {}
+
+    def add_sheet(self, name, header):
+        worksheet = self.workbook.add_worksheet(name)
+        if not self.table:
+            worksheet.write_row(0, 0, header, self.formats['header'])
+        self._sheets[name] = {
+            'worksheet': worksheet,
+            'header': list(header),
+            'next_row': 1,
+            'width': len(header),
+        }
+
+    def append(self, name, row, fmt=None, cell_formats=None):
+        """
+        Add one row to a sheet. fmt is a PALETTE name for the whole row, and
+        cell_formats maps column numbers to PALETTE names for single cells.
+        """
+        sheet = self._sheets[name]
+        worksheet = sheet['worksheet']
+        row_num = sheet['next_row']
+        if cell_formats:
+            for col, value in enumerate(row):
+                cell_format = cell_formats.get(col, fmt)
+                worksheet.write(row_num, col, value,
+                                self.formats[cell_format] if cell_format else None)
+        else:
+            worksheet.write_row(row_num, 0, row, self.formats[fmt] if fmt else None)
+        sheet['next_row'] = row_num + 1
+        sheet['width'] = max(sheet['width'], len(row))
+
+    def rows(self, name):
+        """
+        Number of data rows written to a sheet so far (header not included).
+        """
+        return self._sheets[name]['next_row'] - 1
+
+    def close(self):
+        for sheet in self._sheets.values():
+            worksheet = sheet['worksheet']
+            last_row = sheet['next_row'] - 1
+            last_col = sheet['width'] - 1
+            if self.table:
+                header = sheet['header'] + [f'column_{x + 1}' for x in range(len(sheet['header']), sheet['width'])]
+                worksheet.add_table(0, 0, max(last_row, 1), last_col,
+                                    {'columns': [{'header': h} for h in header]})
+            else:
+                worksheet.autofilter(0, 0, last_row, last_col)
+        self.workbook.close()
@@ -0,0 +1,133 @@
+#
+# Memoized fuzzy name scores. The same award PIs are scored against the same
+# userlist entries run after run, so fuzz.ratio results are kept in an LRU
+# cache keyed by the normalized name pair, optionally saved to disk between
+# runs as gzipped JSON. A saved cache is only reused with the userlist it was
+# built for.
+#
+from collections import OrderedDict
+import gzip
+import hashlib
+import json
+import logging
+
+
+MAXSIZE = 1000000
+
+
+class ScoreCache:
+    """
+    An LRU cache of fuzz.ratio(a, b) keyed by (a, b), with hit and miss
+    counters. With track_new set (in pool workers), scores computed since the
+    last take_new() are also kept apart so they can be sent back to the parent
+    process.
+    """
+
+    def __init__(self, maxsize=MAXSIZE):
+        self.maxsize = maxsize
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.track_new = False
+        self._scores = OrderedDict()
+        self._new = {}
+
+    def __len__(self):
+        return len(self._scores)
+
+    def ratio(self, a, b):
+        key = (a, b)
+        score = self._scores.get(key)
+        if score is not None:
+            self._scores.move_to_end(key)
+            self.hits += 1
+            return score
+
+        from fuzzywuzzy import fuzz
+
+        self.misses += 1
+        score = fuzz.ratio(a, b)
+        self._store(key, score)
+        if self.track_new:
+            self._new[key] = score
+        return score
+
+    def _store(self, key, score):
+        self._scores[key] = score
+        self._scores.move_to_end(key)
+        if len(self._scores) > self.maxsize:
+            self._scores.popitem(last=False)
+
+    def scores(self):
+        return dict(self._scores)
+
+    def take_new(self):
+        """
+        Return the scores computed since the last call, and the hit and miss
+        counts, then reset them.
+        """
+        new, hits, misses = self._new, self.hits, self.misses
+        self._new, self.hits, self.misses = {}, 0, 0
+        return new, hits, misses
+
+    def merge(self, scores, hits=0, misses=0):
+        for key, score in scores.items():
+            self._store(key, score)
+        self.hits += hits
+        self.misses += misses
+
+    def load(self, path, version):
+        """
+        Load scores saved for this userlist version. A missing file, or one
+        saved for another version, leaves the cache empty.
+        """
+        self.version = version
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as x:
+            logging.warning(f'could not read score cache {path} because {x}')
+            return
+        if not isinstance(data, dict) or data.get('version') != version:
+            logging.info(f'score cache {path} is for another userlist, starting over')
+            return
+        self.merge({(a, b): score for a, b, score in data['scores']})
+        logging.info(f'{len(self._scores)} scores loaded from {path}')
+
+    def save(self, path):
+        """
+        Save the scores as {"version": ..., "scores": [[a, b, score], ...]}.
+        """
+        scores = [[a, b, score] for (a, b), score in self._scores.items()]
+        with gzip.open(path, 'wt', encoding='utf-8') as f:
+            json.dump({'version': self.version, 'scores': scores}, f)
+
+    def stats(self):
+        total = self.hits + self.misses
+        rate = 100 * self.hits / total if total else 0
+        return f'score cache: {self.hits} hits, {self.misses} misses ({rate:.1f}% hit rate), {len(self)} entries'
+
+
+SCORES = ScoreCache()
+
+
+def ratio(a, b):
+    """
+    fuzz.ratio(a, b) through the shared SCORES cache.
+    """
+
+    return SCORES.ratio(a, b)
+
+
+def userlist_version(userlist):
+    """
+    A digest of the userlist file, used to tie a saved cache to its userlist.
+    """
+
+    digest = hashlib.sha1()
+    with open(userlist, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
@@ -0,0 +1,39 @@
+#
+# The entry point and the scraper modules must not import the heavy
+# dependencies at load time; each stage imports what it needs when it runs.
+#
+import os
+import subprocess
+import sys
+
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+
+HEAVY = ('requests', 'bs4', 'openpyxl', 'xlsxwriter', 'fuzzywuzzy')
+
+
+def imported_modules(*args):
+    """
+    Run python -X importtime with args in src/ and return the top level
+    packages it imported.
+    """
+
+    result = subprocess.run([sys.executable, '-X', 'importtime'] + list(args),
+                            cwd=SRC, capture_output=True, text=True)
+    modules = set()
+    for line in result.stderr.splitlines():
+        if line.startswith('import time:') and '|' in line:
+            modules.add(line.rsplit('|', 1)[1].strip().split('.')[0])
+    return modules
+
+
+def test_help_imports_nothing_heavy():
+    modules = imported_modules('cli.py', '-h')
+    assert 'argparse' in modules
+    assert not modules.intersection(HEAVY)
+
+
+def test_scraper_modules_import_nothing_heavy():
+    modules = imported_modules('-c', 'import nsf_api_scraper, nih_api_scraper, doe_scraper')
+    assert 'nsf_api_scraper' in modules
+    assert not modules.intersection(HEAVY)